@@ -84,6 +84,14 @@ class RenderReport(View):
 
         response = self.get_empty_pdf_response(request, standup)
 
+        self.issue_loader = IssueLoader()
+        self.issue_loader.prefetch_failsafe(
+            ticket
+            for s in summaries
+            for text in (s.what_was_done, s.current_task, s.next_task, s.general_notes)
+            for ticket, modifiers, description in SummaryParser().parse(text)
+        )
+
         elements = []
 
         doc = SimpleDocTemplate(response)
@@ -123,7 +131,7 @@ class RenderReport(View):
 
         result = []
         for ticket, modifiers, description in parsed:
-            issue = IssueLoader().get_issue(ticket)
+            issue = self.issue_loader.get_issue(ticket)
             m = '[{}]'.format(' '.join(modifiers)) if modifiers else ''
             if issue:
                 description = issue.title
@@ -4,10 +4,12 @@ from django.db.models import F, Sum
 from django.template import loader
 from django_orm_sugar import Q
 
-from botapp.models import Team, Worklog
+from botapp.enums import GitHosting
+from botapp.models import Team, UserProfile
 from botapp.outputs import get_output
 from botapp.trackers import JiraLoader, SMonLoader, UpworkLoader
-from gitapp.git_utils import GitlabLoader
+from gitapp.git_utils import GithubLoader, GitlabLoader
+from gitapp.models import GitProject
 
 
 class BaseAction:
@@ -55,21 +57,18 @@ class IssueAction(BaseDateAction):
             UpworkLoader().sync(from_date, to_date)
             SMonLoader().sync(from_date, to_date)
 
-        users = {}
-        for w in (
-            Worklog.objects.between(from_date, to_date)
-            .filter(Q.user_profile.active == True)
-            .prefetch_related('user_profile')
-        ):
-            if w.user_profile and not w.description:
-                key = w.user_profile.id
-                if key in users:
-                    users[key][1] += w.hours
-                else:
-                    users[key] = [w.user_profile, w.hours]
+        work_date = Q.worklog_days.date
+        users = (
+            UserProfile.objects.filter(
+                Q.active == True, work_date >= from_date, work_date <= to_date
+            )
+            .annotate(undescribed_hours=Sum(F(Q.worklog_days.undescribed_hours.get_path())))
+            .filter(Q.undescribed_hours > 0)
+            .order_by('name')
+        )
 
         if users:
-            user_list = sorted(users.values(), key=lambda x: x[0].name)
+            user_list = [[u, u.undescribed_hours] for u in users]
             t = loader.get_template('missing_memo_report.txt')
             context = {'timesheet': user_list, 'title': options.get('title', '')}
 
@@ -96,12 +95,11 @@ class ReportAction(BaseDateAction):
         assert team, 'Please specify default team'
 
         qs = team.user_profiles.all()
-        work_date = Q.worklog.work_date
+        work_date = Q.worklog_days.date
         for u in (
             qs.order_by('name')
             .filter(work_date >= from_date, work_date <= to_date)
-            .prefetch_related('worklog_set')
-            .annotate(total_hours=Sum(F(Q.worklog.hours.get_path())))
+            .annotate(total_hours=Sum(F(Q.worklog_days.hours.get_path())))
         ):
             users.append(u)
         return self.send_message(users, from_date, to_date, options)
@@ -117,6 +115,11 @@ class SyncGitlabAction(BaseDateAction):
         GitlabLoader().sync(from_date, to_date)
 
 
+class SyncGithubAction(BaseDateAction):
+    def handle_dates(self, from_date, to_date, options):
+        GithubLoader().sync(from_date, to_date)
+
+
 class SyncSMonAction(BaseDateAction):
     def handle_dates(self, from_date, to_date, options):
         SMonLoader().sync(from_date, to_date)
@@ -124,13 +127,25 @@ class SyncSMonAction(BaseDateAction):
 
 class SyncJiraAction(BaseDateAction):
     def handle_dates(self, from_date, to_date, options):
-        JiraLoader().sync(from_date, to_date)
+        if options.get('incremental'):
+            JiraLoader().sync_incremental(from_date)
+        else:
+            JiraLoader().sync(from_date, to_date)
 
 
 class GitlabScheduledStatusAction(BaseAction):
     def handle(self, *args, **options):
-        schedules = GitlabLoader().get_pipeline_schedules(options['project_id'])
-        self.send_message(schedules, options)
+        projects = GitProject.objects.filter(hosting=GitHosting.gitlab).order_by('name')
+        project_ids = options.get('project_id') or []
+        if not isinstance(project_ids, (list, tuple)):
+            project_ids = [project_ids]
+        if project_ids:
+            projects = projects.filter(project_id__in=[str(p) for p in project_ids])
+
+        # project_url belongs to a single selected project, web urls of others are fetched
+        default_url = options.get('project_url') if len(project_ids) == 1 else ''
+        statuses = GitlabLoader().get_schedule_statuses(list(projects), default_url or '')
+        self.send_message(statuses, options)
 
     def send_message(self, schedules, options):
         output_name = options.get('output', 'console')
@@ -4,14 +4,26 @@ import plotly.graph_objs as go
 import plotly.offline as opy
 from django.contrib import admin
 from django.contrib.admin.views.main import ChangeList
+from django.db import transaction
 from django.db.models import Count, Sum
 from django.http.response import HttpResponseRedirect
 from django.urls import path
 from django.utils.safestring import mark_safe
 from django_orm_sugar import Q
 
+from botapp import report_cache
 from botapp.enums import ServiceType
-from botapp.models import Issue, ServiceAccount, Team, UserProfile, Worklog, Tag
+from botapp.models import (
+    Issue,
+    ServiceAccount,
+    SyncCursor,
+    Tag,
+    Team,
+    UserProfile,
+    Worklog,
+    WorklogDay,
+)
+from botapp.report_cache import DataVersionAdminMixin
 from botapp.tasks import sync_jira
 
 
@@ -105,7 +117,8 @@ class UpworkChangeList(ChangeList):
 
 
 @admin.register(Worklog)
-class WorklogAdmin(admin.ModelAdmin):
+class WorklogAdmin(DataVersionAdminMixin, admin.ModelAdmin):
+    data_source = report_cache.WORKLOGS
     list_display = [
         'user',
         'work_date',
@@ -176,8 +189,15 @@ class WorklogAdmin(admin.ModelAdmin):
     def logged(self, obj):
         return '{:.1f}h'.format(obj.hours)
 
+    def delete_queryset(self, request, queryset):
+        # bulk delete doesn't call Worklog.delete()
+        with transaction.atomic():
+            dates = queryset.effective_dates()
+            super().delete_queryset(request, queryset)
+            WorklogDay.objects.refresh(dates)
+
     def sync(self, request):
-        sync_jira(last_days=2)
+        sync_jira(last_days=2, incremental=True)
         return HttpResponseRedirect('/admin/botapp/worklog/')
 
 
@@ -273,3 +293,8 @@ class TeamAdmin(admin.ModelAdmin):
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ['name', 'use_tag']
+
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    list_display = ['source', 'value', 'updated']
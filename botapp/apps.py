@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class BotappConfig(AppConfig):
     name = 'botapp'
+
+    def ready(self):
+        from botapp.report_cache import connect_signals
+
+        connect_signals()
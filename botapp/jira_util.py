@@ -1,18 +1,64 @@
 import os
-from functools import cached_property, lru_cache
+from functools import cached_property
 
-import requests
 from django.conf import settings
+from django.core.cache import caches
 
 from botapp.enums import IssueSystem
 from botapp.models import Issue
+from teambot import transport
 
 
 LOGIN_URL = '{}/rest/auth/latest/session'.format(settings.JIRA_BASE_URL)
 CUSTOM_ETA_FIELD = os.environ.get('CUSTOM_ETA_FIELD', 'customfield_10035')
+# max number of ids accepted by /worklog/list
+WORKLOG_LIST_LIMIT = 1000
+# number of keys in a single `key in (...)` search
+SEARCH_LIMIT = 100
+# responses for issues which don't exist or aren't visible to JIRA_USER
+MISSING_ISSUE_STATUSES = (403, 404)
+# fields used to create or update Issue
+ISSUE_FIELDS = ['summary', 'description', 'labels', 'parent', 'timetracking', CUSTOM_ETA_FIELD]
+
+
+class IssueCache:
+    """
+    Jira issue payloads shared between processes through the Django cache framework.
+
+    Error payloads of missing issues are cached with a shorter negative_timeout.
+    """
+
+    prefix = 'jira-issue'
+
+    def __init__(self, alias=None, timeout=None, negative_timeout=None):
+        self.cache = caches[alias or settings.JIRA_ISSUE_CACHE]
+        self.timeout = timeout or settings.JIRA_ISSUE_CACHE_TTL
+        self.negative_timeout = negative_timeout or settings.JIRA_ISSUE_NEGATIVE_CACHE_TTL
+        self.negative_hits = 0
+
+    def make_key(self, issue_id):
+        return '{}:{}'.format(self.prefix, str(issue_id).upper())
+
+    def get(self, issue_id):
+        payload = self.cache.get(self.make_key(issue_id))
+        if payload is not None and 'fields' not in payload:
+            self.negative_hits += 1
+        return payload
+
+    def set(self, issue_id, payload):
+        # an issue is requested both by numeric id (worklogs) and by key (memos)
+        keys = {issue_id, payload.get('id'), payload.get('key')} - {None}
+        self.cache.set_many({self.make_key(k): payload for k in keys}, self.timeout)
+
+    def set_missing(self, issue_id, payload=None):
+        payload = payload or {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        self.cache.set(self.make_key(issue_id), payload, self.negative_timeout)
 
 
 class JiraFetcher:
+    def __init__(self, issue_cache=None):
+        self.issue_cache = issue_cache or IssueCache()
+
     @cached_property
     def auth(self):
         return (os.environ['JIRA_USER'], os.environ['JIRA_TOKEN'])
@@ -21,42 +67,117 @@ class JiraFetcher:
     def api_url(self):
         return f'{settings.JIRA_BASE_URL}/rest/api/latest'
 
-    @lru_cache
     def fetch_jira_issue(self, issue_id):
-        s = requests.session()
-        issue_url = '{}/rest/api/latest/issue/{}'.format(settings.JIRA_BASE_URL, issue_id)
-        j = s.get(issue_url, auth=self.auth).json()
+        j = self.issue_cache.get(issue_id)
+        if j is None:
+            r = self.request_jira_issue(issue_id)
+            j = r.json()
+            if 'fields' in j:
+                self.issue_cache.set(issue_id, j)
+            elif r.status_code in MISSING_ISSUE_STATUSES:
+                self.issue_cache.set_missing(issue_id, j)
         return j
 
-    def iter_worklogs(self, session, values):
-        for item in values:
-            worklog_id = item['worklogId']
-            updated = item['updatedTime']
-            resp = session.post(
-                f'{self.api_url}/worklog/list', json={'ids': [worklog_id]}, auth=self.auth
+    def request_jira_issue(self, issue_id):
+        return self.request('get', f'{self.api_url}/issue/{issue_id}')
+
+    def search_jira_issues(self, keys):
+        """
+        Fetch issues by keys with `key in (...)` JQL searches and cache them.
+        Keys which don't exist or aren't accessible are missing in results.
+        """
+        issues = []
+        for i in range(0, len(keys), SEARCH_LIMIT):
+            chunk = keys[i : i + SEARCH_LIMIT]
+            resp = self.request(
+                'post',
+                f'{self.api_url}/search',
+                json={
+                    'jql': 'key in ({})'.format(', '.join(chunk)),
+                    'fields': ISSUE_FIELDS,
+                    'maxResults': SEARCH_LIMIT,
+                    # unknown keys are reported as warnings instead of failing the query
+                    'validateQuery': 'warn',
+                },
+            )
+            assert resp.status_code == 200, (resp, resp.reason)
+            found = set()
+            for j in resp.json()['issues']:
+                self.issue_cache.set(j['key'], j)
+                issues.append(j)
+                found.add(j['key'])
+
+            for key in set(chunk) - found:
+                self.issue_cache.set_missing(key)
+        return issues
+
+    def request(self, method, url, **kwargs):
+        return transport.request(method, url, auth=self.auth, **kwargs)
+
+    def iter_worklogs(self, values):
+        """
+        Resolve /worklog/updated values into worklogs, yields (worklog, updatedTime) in the
+        order of values
+        """
+        for i in range(0, len(values), WORKLOG_LIST_LIMIT):
+            chunk = values[i : i + WORKLOG_LIST_LIMIT]
+            resp = self.request(
+                'post',
+                f'{self.api_url}/worklog/list',
+                json={'ids': [item['worklogId'] for item in chunk]},
             )
             assert resp.status_code == 200, (resp, resp.reason)
-            resp = resp.json()
-            for i in resp:
-                yield resp[0], updated
+            worklogs = {str(w['id']): w for w in resp.json()}
+            for item in chunk:
+                worklog = worklogs.get(str(item['worklogId']))
+                if worklog:
+                    yield worklog, item['updatedTime']
+
+    def iter_worklog_pages(self, resource, since):
+        """
+        Walk /worklog/updated or /worklog/deleted pages starting from `since` (unix ms)
+        """
+        last = False
+        while not last:
+            resp = self.request(
+                'get', f'{self.api_url}/worklog/{resource}', params={'since': since}
+            ).json()
+            last = resp['lastPage']
+            since = resp['until']
+            yield resp
 
     def fetch_worklogs(self, start, end):
-        with requests.session() as session:
-            start_unix = int(start.timestamp() * 1000)
-            end_unix = int(end.timestamp() * 1000)
-            last = None
-            while not last:
-                resp = session.get(
-                    f'{settings.JIRA_BASE_URL}/rest/api/latest/worklog/updated',
-                    auth=self.auth,
-                    params={'since': start_unix},
-                ).json()
-                last = resp['lastPage']
-                start_unix = resp['until']
-                for i, updated in self.iter_worklogs(session, resp['values']):
-                    if updated > end_unix:
-                        return
-                    yield i
+        start_unix = int(start.timestamp() * 1000)
+        end_unix = int(end.timestamp() * 1000)
+        for page in self.iter_worklog_pages('updated', start_unix):
+            for i, updated in self.iter_worklogs(page['values']):
+                if updated > end_unix:
+                    return
+                yield i
+
+    def fetch_updated_worklogs(self, since):
+        """
+        Fetch all worklogs changed after `since` (unix ms)
+
+        :return: tuple (worklogs, until), `until` is `since` for the next call
+        """
+        worklogs = []
+        for page in self.iter_worklog_pages('updated', since):
+            worklogs.extend(i for i, updated in self.iter_worklogs(page['values']))
+            since = max(since, page['until'])
+        return worklogs, since
+
+    def fetch_deleted_worklog_ids(self, since):
+        """
+        Fetch ids of worklogs deleted after `since` (unix ms)
+
+        :return: tuple (ids, until), `until` is `since` for the next call
+        """
+        ids = []
+        for page in self.iter_worklog_pages('deleted', since):
+            ids.extend(str(item['worklogId']) for item in page['values'])
+            since = max(since, page['until'])
+        return ids, since
 
     def get_original_estimate(self, issue_dict):
         tt = issue_dict.get('fields', {}).get('timetracking', {})
@@ -82,16 +203,21 @@ class JiraFetcher:
             description = j['fields']['description']
             summary = j['fields']['summary']
             labels = self.get_labels(j)
-            print('creating issue: {}'.format(issue_id))
-            return Issue.objects.create(
+            # the same new issue can be created concurrently, e.g. by project sync threads
+            issue, created = Issue.objects.get_or_create(
                 issue_system=IssueSystem.jira,
                 issue_id=issue_id,
-                title=summary,
-                description=description or '',
-                original_estimate=self.get_original_estimate(j),
-                url='{}/browse/{}'.format(settings.JIRA_BASE_URL, issue_id),
-                tags=labels,
+                defaults={
+                    'title': summary,
+                    'description': description or '',
+                    'original_estimate': self.get_original_estimate(j),
+                    'url': '{}/browse/{}'.format(settings.JIRA_BASE_URL, issue_id),
+                    'tags': labels,
+                },
             )
+            if created:
+                print('creating issue: {}'.format(issue_id))
+            return issue
 
     def update_jira_issue(self, issue, issue_id):
         j = self.fetch_jira_issue(issue_id)
@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from botapp import report_cache
+from botapp.models import WorklogDay
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily worklog rollup from all worklogs'
+
+    def handle(self, *args, **options):
+        count = WorklogDay.objects.rebuild()
+        report_cache.bump_data_version(report_cache.WORKLOGS)
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} worklog days'.format(count)))
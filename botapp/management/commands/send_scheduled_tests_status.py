@@ -10,6 +10,9 @@ class Command(GitlabScheduledStatusAction, BaseCommand):
         parser.add_argument('-o', '--output',
                             default='console',
                             choices=['console', 'slack'])
-        parser.add_argument('--project-id', required=True, type=int)
-        parser.add_argument('--project-url', required=True, type=str)
+        parser.add_argument('--project-id', action='append',
+                            help='GitLab project id, all GitLab projects by default')
+        parser.add_argument('--project-url', required=False, type=str,
+                            help='Web url of the project given with a single --project-id, '
+                                 'used when its GitProject.project_url is empty')
         add_output_arguments(parser)
@@ -0,0 +1,9 @@
+from botapp.management import BaseDateCommand
+from gitapp.git_utils import GithubLoader
+
+
+class Command(BaseDateCommand):
+    help = 'Sync GitHub commits into Django db'
+
+    def handle_dates(self, from_date, to_date, options):
+        GithubLoader().sync(from_date, to_date)
@@ -5,5 +5,17 @@ from botapp.trackers import JiraLoader
 class Command(BaseDateCommand):
     help = 'Sync JIRA reports into Django db'
 
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--incremental',
+            help='Sync worklogs changed since the previous incremental run, '
+            'date range is used for the first run only',
+            action='store_true',
+        )
+
     def handle_dates(self, from_date, to_date, options):
-        JiraLoader(self).sync(from_date, to_date)
+        if options.get('incremental'):
+            JiraLoader(self).sync_incremental(from_date)
+        else:
+            JiraLoader(self).sync(from_date, to_date)
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.12 on 2026-10-18 19:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FILL_WORKLOG_DAYS = '''
+INSERT INTO botapp_worklogday
+    (date, worklog_system, user_profile_id, issue_id, hours, worklog_count, undescribed_hours)
+SELECT COALESCE(custom_work_date, work_date), worklog_system, user_profile_id, issue_id,
+    SUM(hours), COUNT(*), COALESCE(SUM(hours) FILTER (WHERE description = ''), 0)
+FROM botapp_worklog
+GROUP BY 1, 2, 3, 4
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0015_sync_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorklogDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('worklog_system', models.IntegerField(choices=[(0, 'upwork'), (2, 'smon'), (3, 'jira')])),
+                ('hours', models.FloatField(default=0)),
+                ('worklog_count', models.IntegerField(default=0)),
+                ('undescribed_hours', models.FloatField(default=0)),
+                ('issue', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='worklog_days', to='botapp.issue')),
+                ('user_profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='worklog_days', to='botapp.userprofile')),
+            ],
+            options={
+                'index_together': {('date', 'user_profile')},
+            },
+        ),
+        migrations.RunSQL(FILL_WORKLOG_DAYS, migrations.RunSQL.noop),
+    ]
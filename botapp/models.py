@@ -1,6 +1,7 @@
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
 
 from botapp.enums import get_choices, IssueSystem, ServiceType, WorklogSystem
 
@@ -42,6 +43,19 @@ class ServiceAccount(models.Model):
         return '{}: {}'.format(ServiceType(self.service_type).name, self.uid)
 
 
+class SyncCursor(models.Model):
+    """
+    Position of the last incremental sync of a remote source, e.g. Jira `until` timestamp
+    """
+
+    source = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.source, self.value)
+
+
 class Issue(models.Model):
     issue_system = models.IntegerField(default=IssueSystem.jira, choices=get_choices(IssueSystem))
 
@@ -71,10 +85,72 @@ class WorklogManager(models.QuerySet):
             | Q(custom_work_date__isnull=True, work_date__gte=from_date, work_date__lte=to_date)
         )
 
+    def with_effective_date(self):
+        """
+        Annotate the date used by reports: custom_work_date when it's set, else work_date
+        """
+        return self.annotate(effective_date=Coalesce('custom_work_date', 'work_date'))
+
+    def effective_dates(self):
+        return set(
+            self.with_effective_date()
+            .order_by()
+            .values_list('effective_date', flat=True)
+            .distinct()
+        )
+
+    def upsert(self, worklogs):
+        """
+        Write unsaved worklogs with a single INSERT ... ON CONFLICT (uniq_id) DO UPDATE.
+
+        Rows which are identical to the stored ones are not touched, manually set
+        custom_work_date is preserved. Worklogs without uniq_id are always inserted.
+
+        :return: tuple (inserted, updated)
+        """
+        if not worklogs:
+            return 0, 0
+
+        model = self.model
+        fields = [
+            f
+            for f in model._meta.concrete_fields
+            if not f.primary_key and f.name not in model.UPSERT_EXCLUDE
+        ]
+        columns = [connection.ops.quote_name(f.column) for f in fields]
+        placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+        params = []
+        for w in worklogs:
+            params.extend(f.get_db_prep_save(getattr(w, f.attname), connection) for f in fields)
+
+        sql = (
+            'INSERT INTO {table} AS t ({columns}) VALUES {values} '
+            'ON CONFLICT ({uniq}) DO UPDATE SET {updates} '
+            'WHERE ({current}) IS DISTINCT FROM ({excluded}) '
+            'RETURNING (xmax = 0)'
+        ).format(
+            table=connection.ops.quote_name(model._meta.db_table),
+            columns=', '.join(columns),
+            values=', '.join([placeholders] * len(worklogs)),
+            uniq=connection.ops.quote_name('uniq_id'),
+            updates=', '.join('{0} = EXCLUDED.{0}'.format(c) for c in columns),
+            current=', '.join('t.{}'.format(c) for c in columns),
+            excluded=', '.join('EXCLUDED.{}'.format(c) for c in columns),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        inserted = sum(1 for (is_insert,) in rows if is_insert)
+        return inserted, len(rows) - inserted
+
 
 class Worklog(models.Model):
     objects = models.Manager.from_queryset(WorklogManager)()
 
+    # fields maintained in teambot, they are never overwritten by a tracker sync
+    UPSERT_EXCLUDE = ('custom_work_date',)
+
     uniq_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     work_date = models.DateField()
     custom_work_date = models.DateField(null=True, blank=True)
@@ -91,6 +167,20 @@ class Worklog(models.Model):
     user_profile = models.ForeignKey(UserProfile, null=True, blank=True, on_delete=models.SET_NULL)
     issue = models.ForeignKey(Issue, blank=True, null=True, on_delete=models.SET_NULL)
 
+    def save(self, *args, **kwargs):
+        # rows saved one by one, e.g. in admin; loaders refresh the rollup of a whole sync
+        dates = Worklog.objects.filter(pk=self.pk).effective_dates() if self.pk else set()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            dates.add(self.custom_work_date or self.work_date)
+            WorklogDay.objects.refresh(dates)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            WorklogDay.objects.refresh([self.custom_work_date or self.work_date])
+        return result
+
     def get_shiny_description(self):
         if self.issue:
             return self.issue
@@ -101,3 +191,103 @@ class Worklog(models.Model):
         return '[{}/{}]{}: {}, {}/{}'.format(
             self.id, self.uniq_id, self.user_name, self.description, self.work_date, self.hours
         )
+
+
+class WorklogDayManager(models.QuerySet):
+    # namespace of advisory locks of the rollup, the second key is a date ordinal,
+    # 0 is the whole table
+    LOCK_ID = 7254
+
+    def between(self, from_date, to_date):
+        return self.filter(date__gte=from_date, date__lte=to_date)
+
+    def refresh(self, dates):
+        """
+        Recompute the rollup of `dates` from worklogs. It's called in the transaction which
+        changed the worklogs, `dates` should have both old and new effective dates of them.
+        """
+        dates = set(dates)
+        if not dates:
+            return
+        with transaction.atomic():
+            self.lock_dates(dates)
+            self.filter(date__in=dates).delete()
+            worklogs = Worklog.objects.with_effective_date().filter(effective_date__in=dates)
+            self.bulk_create(self.aggregate_worklogs(worklogs), batch_size=1000)
+
+    def lock_dates(self, dates):
+        """
+        Serialize refreshes of the same dates until the end of the transaction. Otherwise
+        a concurrent refresh doesn't see rows inserted by another one and duplicates them.
+        Dates are locked in order, so refreshes of overlapping ranges don't deadlock.
+        """
+        field = self.model._meta.get_field('date')
+        ordinals = sorted(field.to_python(d).toordinal() for d in dates)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock_shared(%s, 0)', [self.LOCK_ID])
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, d) FROM unnest(%s) AS d', [self.LOCK_ID, ordinals]
+            )
+
+    def rebuild(self):
+        """
+        :return: number of rollup rows
+        """
+        with transaction.atomic():
+            # refreshes wait for the rebuild and the rebuild waits for running refreshes
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, 0)', [self.LOCK_ID])
+            self.all().delete()
+            days = self.aggregate_worklogs(Worklog.objects.with_effective_date())
+            self.bulk_create(days, batch_size=1000)
+        return len(days)
+
+    def aggregate_worklogs(self, worklogs):
+        rows = (
+            worklogs.order_by()
+            .values_list('user_profile', 'effective_date', 'issue', 'worklog_system')
+            .annotate(
+                Sum('hours'), Count('id'), undescribed_hours=Sum('hours', filter=Q(description=''))
+            )
+        )
+        return [
+            self.model(
+                user_profile_id=profile_id,
+                date=day,
+                issue_id=issue_id,
+                worklog_system=worklog_system,
+                hours=hours,
+                worklog_count=count,
+                undescribed_hours=undescribed_hours or 0,
+            )
+            for profile_id, day, issue_id, worklog_system, hours, count, undescribed_hours in rows
+        ]
+
+
+class WorklogDay(models.Model):
+    """
+    Daily rollup of worklogs by user profile, effective date, issue and worklog system,
+    reports read it instead of raw worklogs. Rebuilt by `manage.py rebuild_worklog_days`.
+    """
+
+    objects = models.Manager.from_queryset(WorklogDayManager)()
+
+    date = models.DateField()
+    worklog_system = models.IntegerField(choices=get_choices(WorklogSystem))
+    user_profile = models.ForeignKey(
+        UserProfile, null=True, blank=True, related_name='worklog_days', on_delete=models.SET_NULL
+    )
+    issue = models.ForeignKey(
+        Issue, null=True, blank=True, related_name='worklog_days', on_delete=models.SET_NULL
+    )
+
+    hours = models.FloatField(default=0)
+    worklog_count = models.IntegerField(default=0)
+    # hours of worklogs without description
+    undescribed_hours = models.FloatField(default=0)
+
+    class Meta:
+        index_together = ['date', 'user_profile']
+
+    def __str__(self):
+        return '{}: {} {}/{}'.format(self.date, self.user_profile_id, self.issue_id, self.hours)
@@ -1,10 +1,30 @@
 import os
 
 from django.template import loader
-from slack import WebClient as SlackClient
+
+from teambot import transport
 
 
 ALL_OUTPUTS = {}
+SLACK_API_URL = 'https://slack.com/api'
+
+
+def post_slack_message(**kwargs):
+    """
+    Call chat.postMessage through the shared transport, kwargs are the method arguments
+    """
+    r = transport.post(
+        '{}/chat.postMessage'.format(SLACK_API_URL),
+        json=kwargs,
+        headers={'Authorization': 'Bearer {}'.format(os.environ['SLACK_TOKEN'])},
+        # a retried post after a timeout or 5xx could show the message twice
+        idempotent=False,
+    )
+    data = r.json()
+    if not data.get('ok'):
+        error = data.get('error', r.status_code)
+        raise Exception('Slack chat.postMessage failed: {}'.format(error))
+    return data
 
 
 def register_output(cls):
@@ -35,11 +55,7 @@ class SlackTextOutput(BaseTextOutput):
     output_name = 'slack'
 
     def send_message(self, message, options):
-        client = SlackClient(os.environ['SLACK_TOKEN'])
-
-        client.chat_postMessage(
-            channel=options['slack_channel'], text=message, as_user=True
-        )
+        post_slack_message(channel=options['slack_channel'], text=message, as_user=True)
 
 
 @register_output
@@ -83,8 +99,6 @@ class SlackReportOutput(BaseReportOutput):
     output_name = 'slack'
 
     def send_message(self, users, from_date, to_date, options):
-        client = SlackClient(os.environ['SLACK_TOKEN'])
-
         text = self.format_message(users, from_date, to_date)
         markdown = "```{}```".format(text)
         title = "Click for detailed view"
@@ -104,7 +118,7 @@ class SlackReportOutput(BaseReportOutput):
             }
         ]
 
-        client.chat_postMessage(
+        post_slack_message(
             channel=options['slack_channel'],
             attachments=attachments,
             as_user=True,
@@ -112,17 +126,33 @@ class SlackReportOutput(BaseReportOutput):
         return text
 
 
+# pipeline statuses reported by schedule_status outputs: status, color, title
+SCHEDULE_STATUSES = [
+    ('failed', 'danger', 'Scheduled tests have failed'),
+    ('running', '#439FE0', 'Scheduled tests are still running'),
+    ('success', 'good', 'Scheduled tests have passed successfully'),
+]
+# attachment text is cut to keep a post with many projects under Slack message limits
+SLACK_ATTACHMENT_TEXT_LIMIT = 7000
+
+
 @register_output
 class ConsoleSchedulesStatusOutput:
     output_name = 'console'
     message_type = 'schedule_status'
 
-    def send_message(self, schedules, options):
-        if schedules:
-            s = schedules[0]
+    def send_message(self, statuses, options):
+        if statuses:
             print('-- SCHEDULED TESTS --')
-            print('Last run: {}'.format(s['updated_at']))
-            print('Status: {}'.format(s['last_pipeline']['status']))
+            for s in statuses:
+                print(
+                    '{}: {}: {}, last run {}'.format(
+                        s.project.name,
+                        s.schedule.get('description', ''),
+                        s.pipeline.get('status', 'never run'),
+                        s.schedule['updated_at'],
+                    )
+                )
 
 
 @register_output
@@ -130,53 +160,42 @@ class SlackSchedulesStatusOutput:
     output_name = 'slack'
     message_type = 'schedule_status'
 
-    def send_message(self, schedules, options):
-        if schedules:
-            s = schedules[0]
-            client = SlackClient(os.environ['SLACK_TOKEN'])
-            last = s.get('last_pipeline')
-            if last:
-                if last['status'] == 'failed':
-                    self.send_slack_message(
-                        client, last, 'danger', 'Scheduled tests have failed', 'FAILED', options
-                    )
-                elif last['status'] == 'success':
-                    self.send_slack_message(
-                        client,
-                        last,
-                        'good',
-                        'Scheduled tests have passed successfully',
-                        'SUCCESS',
-                        options,
-                    )
-                elif last['status'] == 'running':
-                    self.send_slack_message(
-                        client,
-                        last,
-                        '#439FE0',
-                        'Scheduled tests are still running',
-                        'RUNNING',
-                        options,
-                    )
-
-    def send_slack_message(self, client: SlackClient, pipeline, color, title, status, options):
-        project_url = options.get('project_url', '')
-        attachments = [
-            {
-                "fallback": title,
-                'title': title,
-                "text": "<{project_url}/pipelines/{pipeline_id}|Pipeline #{pipeline_id}>"
-                " - {status}".format(
-                    pipeline_id=pipeline['id'], project_url=project_url, status=status
-                ),
-                "color": color,
-            }
-        ]
-        client.chat_postMessage(
-            channel=options['slack_channel'],
-            as_user=True,
-            attachments=attachments,
-        )
+    def send_message(self, statuses, options):
+        """
+        All projects are reported by a single post with an attachment per status
+        """
+        attachments = []
+        for status, color, title in SCHEDULE_STATUSES:
+            lines = [self.format_line(s) for s in statuses if s.pipeline.get('status') == status]
+            if lines:
+                text = self.join_lines(lines)
+                attachments.append(
+                    {
+                        "fallback": title,
+                        "title": '{} ({})'.format(title, len(lines)),
+                        "text": text,
+                        "color": color,
+                    }
+                )
+
+        if attachments:
+            post_slack_message(
+                channel=options['slack_channel'], as_user=True, attachments=attachments
+            )
+
+    def format_line(self, s):
+        name = '{} #{}'.format(s.project.name, s.pipeline['id'])
+        if s.pipeline_url:
+            name = '<{}|{}>'.format(s.pipeline_url, name)
+        return '{} {}'.format(name, s.schedule.get('description', ''))
+
+    def join_lines(self, lines):
+        text = ''
+        for i, line in enumerate(lines):
+            if len(text) + len(line) > SLACK_ATTACHMENT_TEXT_LIMIT:
+                return text + '... and {} more'.format(len(lines) - i)
+            text += line + '\n'
+        return text
 
 
 def get_output(message_type, output_name):
@@ -0,0 +1,123 @@
+"""
+Cache of computed dashboard reports.
+
+Every source of report data has a version which is bumped when the data changes.
+A cached report is stored together with the versions it was computed from, both are
+read by a single get_many, so stale reports are never served and a warm hit doesn't
+touch the database.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
+
+
+WORKLOGS = 'worklogs'
+COMMITS = 'commits'
+TEAMS = 'teams'
+SOURCES = (WORKLOGS, COMMITS, TEAMS)
+
+
+def get_cache():
+    return caches[settings.REPORT_CACHE]
+
+
+def make_version_key(source):
+    return 'data-version:{}'.format(source)
+
+
+def make_report_key(key_parts):
+    return 'report:{}'.format(':'.join(map(str, key_parts)))
+
+
+def new_version():
+    # a version lost by eviction is restarted from a value greater than any previous one
+    return int(time.time() * 1000)
+
+
+def bump_data_version(source):
+    """
+    Invalidate reports computed from `source` once the current transaction is committed
+    """
+
+    def bump():
+        cache = get_cache()
+        key = make_version_key(source)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+    transaction.on_commit(bump)
+
+
+def get_data_versions(values):
+    return tuple(values.get(make_version_key(source)) for source in SOURCES)
+
+
+def get_cached_report(key_parts, compute):
+    """
+    :param key_parts: report identity, e.g. ('user', user.id, from_date, to_date)
+    :param compute: callable which creates the report on a cache miss
+    """
+    cache = get_cache()
+    key = make_report_key(key_parts)
+    values = cache.get_many([key] + [make_version_key(source) for source in SOURCES])
+    versions = get_data_versions(values)
+
+    entry = values.get(key)
+    if entry is not None and entry[0] == versions and None not in versions:
+        return entry[1]
+
+    if None in versions:
+        for source in SOURCES:
+            # versions never expire, redis evicts only keys with a timeout (volatile-lru)
+            cache.add(make_version_key(source), new_version(), None)
+        versions = get_data_versions(
+            cache.get_many([make_version_key(source) for source in SOURCES])
+        )
+
+    report = compute()
+    cache.set(key, (versions, report), settings.REPORT_CACHE_TTL)
+    return report
+
+
+def connect_signals():
+    """
+    Rows saved one by one, e.g. in admin. Loaders write in bulk and bump versions
+    explicitly. There are no delete receivers: they would turn bulk deletes of a sync
+    into row by row deletes, see DataVersionAdminMixin.
+    """
+    from botapp.models import Team, Worklog
+    from gitapp.models import GitCommit
+
+    for model, source in ((Worklog, WORKLOGS), (GitCommit, COMMITS)):
+        post_save.connect(
+            lambda sender, source=source, **kwargs: bump_data_version(source),
+            sender=model,
+            weak=False,
+        )
+
+    def on_members_changed(sender, action, **kwargs):
+        if action.startswith('post_'):
+            bump_data_version(TEAMS)
+
+    m2m_changed.connect(on_members_changed, sender=Team.user_profiles.through, weak=False)
+
+
+class DataVersionAdminMixin:
+    """
+    Bump the data version of `data_source` when rows are deleted in admin
+    """
+
+    data_source = None
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_data_version(self.data_source)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_data_version(self.data_source)
@@ -4,6 +4,7 @@ from botapp.actions import (
     GitlabScheduledStatusAction,
     IssueAction,
     ReportAction,
+    SyncGithubAction,
     SyncGitlabAction,
     SyncJiraAction,
     SyncSMonAction,
@@ -26,6 +27,11 @@ def sync_gitlab(**options):
     SyncGitlabAction().handle(**options)
 
 
+@app.task
+def sync_github(**options):
+    SyncGithubAction().handle(**options)
+
+
 @app.task
 def sync_smon(**options):
     SyncSMonAction().handle(**options)
@@ -1,4 +1,5 @@
 import pytest
+from django.core.cache import caches
 
 
 @pytest.fixture(scope='session', autouse=True)
@@ -7,6 +8,12 @@ def session_settings(session_settings):
     yield session_settings
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    yield
+    caches['default'].clear()
+
+
 NOTIFICATION = '''
 {
    "timestamp":1614983754173,
@@ -0,0 +1,245 @@
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from botapp.enums import IssueSystem, WorklogSystem
+from botapp.models import Issue, Team, UserProfile, Worklog
+from botapp.report_cache import get_cached_report
+from botapp.views import Report, TeamReport
+from gitapp.models import GitCommit, GitProject
+
+
+class TestDashboardReport(TestCase):
+    from_date = date(2021, 3, 1)
+    to_date = date(2021, 3, 31)
+
+    def setUp(self):
+        self.user = UserProfile.objects.create(name='dev')
+        other = UserProfile.objects.create(name='other')
+        issue = Issue.objects.create(issue_system=IssueSystem.jira, issue_id='BACK-1', title='t')
+        project = GitProject.objects.create(project_id='1', name='app')
+
+        for day in range(1, 31):
+            work_date = date(2021, 3, day)
+            for profile in (self.user, other):
+                Worklog.objects.create(
+                    work_date=work_date,
+                    user_id='1',
+                    user_name=profile.name,
+                    hours=1.5,
+                    worklog_system=WorklogSystem.jira,
+                    user_profile=profile,
+                    issue=issue,
+                )
+            created_at = datetime(2021, 3, day, 12, tzinfo=timezone.utc)
+            GitCommit.objects.create(
+                hash='{:040}'.format(day),
+                short_id=str(day),
+                title='commit',
+                message='',
+                created_at=created_at,
+                author_profile=self.user,
+                project=project,
+                issue=issue,
+                additions=day,
+                deletions=1,
+            )
+
+        # moved to another day in teambot
+        Worklog.objects.create(
+            work_date=date(2021, 2, 27),
+            custom_work_date=date(2021, 3, 31),
+            user_id='1',
+            user_name='dev',
+            hours=2,
+            description='moved',
+            worklog_system=WorklogSystem.jira,
+            user_profile=self.user,
+        )
+
+    def test_bounded_queries(self):
+        # grouped hours, worklogs, grouped changes, commits
+        with self.assertNumQueries(4):
+            report = Report(self.user, self.from_date, self.to_date)
+
+        summary = {d['date']: d for d in report.summary}
+        assert len(summary) == 31
+        day = summary[date(2021, 3, 10)]
+        assert day['tracker_hours'] == 1.5
+        assert (day['gitlab_adds'], day['gitlab_dels']) == (10, -1)
+        assert [c.issue.issue_id for c in day['gitlab_commits']] == ['BACK-1']
+        assert summary[date(2021, 3, 31)]['tracker_hours'] == 2
+        assert summary[date(2021, 3, 31)]['tracker_text'] == ['moved']
+
+    def test_query_count_independent_of_range(self):
+        with self.assertNumQueries(4):
+            Report(self.user, self.from_date - timedelta(365), self.to_date)
+
+    def test_chart_data(self):
+        data = Report(self.user, self.from_date, self.to_date).get_chart_data()
+
+        assert data['range'] == ['2021-03-01', '2021-03-31']
+        assert len(data['dates']) == len(data['gitlab']['text']) == 31
+        i = data['dates'].index('2021-03-10')
+        assert data['tracker']['hours'][i] == 1.5
+        assert (data['gitlab']['additions'][i], data['gitlab']['deletions'][i]) == (10, -1)
+        assert data['tracker']['text'][data['dates'].index('2021-03-31')] == 'moved'
+
+
+class TestTeamReport(TestCase):
+    day = date(2021, 3, 2)
+
+    def add_member(self, team, name):
+        profile = UserProfile.objects.create(name=name)
+        team.user_profiles.add(profile)
+        Worklog.objects.create(
+            work_date=self.day,
+            user_id=name,
+            user_name=name,
+            hours=2,
+            worklog_system=WorklogSystem.jira,
+            user_profile=profile,
+        )
+        return profile
+
+    def test_queries_independent_of_team_size(self):
+        team = Team.objects.create(name='backend')
+        alice = self.add_member(team, 'alice')
+        bob = self.add_member(team, 'bob')
+        GitCommit.objects.create(
+            hash='1' * 40,
+            short_id='1',
+            title='c',
+            message='',
+            author_profile=alice,
+            committer_profile=bob,
+            additions=10,
+            deletions=3,
+            created_at=datetime(2021, 3, 2, 12, tzinfo=timezone.utc),
+        )
+
+        # members, grouped worklogs, grouped commits
+        with self.assertNumQueries(3):
+            report = TeamReport(team, self.day - timedelta(1), self.day)
+
+        assert [m.name for m in report.members] == ['alice', 'bob']
+        day = report.summary[0]
+        assert day['date'] == self.day
+        assert day['members'] == [
+            {'tracker_hours': 2, 'gitlab_adds': 10, 'gitlab_dels': -3},
+            {'tracker_hours': 2, 'gitlab_adds': 10, 'gitlab_dels': -3},
+        ]
+        assert report.totals[0]['tracker_hours'] == 2
+
+        for i in range(10):
+            self.add_member(team, 'dev{}'.format(i))
+        with self.assertNumQueries(3):
+            report = TeamReport(team, self.day - timedelta(1), self.day)
+        assert len(report.totals) == 12
+
+
+class TestReportCache(TransactionTestCase):
+    day = date(2021, 3, 2)
+
+    def setUp(self):
+        self.user = UserProfile.objects.create(name='dev')
+        self.worklog = Worklog.objects.create(
+            work_date=self.day,
+            user_id='1',
+            user_name='dev',
+            hours=2,
+            worklog_system=WorklogSystem.jira,
+            user_profile=self.user,
+        )
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def get_report(self):
+        key = ('user', self.user.id, self.day, self.day)
+        return get_cached_report(key, lambda: Report(self.user, self.day, self.day))
+
+    def test_warm_hit_is_single_cache_read(self):
+        self.get_report()
+
+        cache = caches['default']
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, patch.object(
+            cache, 'set'
+        ) as set_, self.assertNumQueries(0):
+            report = self.get_report()
+
+        assert get_many.call_count == 1 and not set_.called
+        assert report.summary[0]['tracker_hours'] == 2
+
+    def test_saved_worklog_invalidates_report(self):
+        self.get_report()
+        self.worklog.hours = 3
+        self.worklog.save()
+
+        assert self.get_report().summary[0]['tracker_hours'] == 3
+
+    def test_team_members_change_invalidates_team_report(self):
+        team = Team.objects.create(name='backend')
+
+        def get_team_report():
+            return get_cached_report(
+                ('team', team.id, self.day, self.day), lambda: TeamReport(team, self.day, self.day)
+            )
+
+        assert get_team_report().members == []
+        team.user_profiles.add(self.user)
+        assert [m.name for m in get_team_report().members] == ['dev']
+
+
+class TestChartDataView(TransactionTestCase):
+    day = date(2021, 3, 2)
+
+    def setUp(self):
+        self.user = UserProfile.objects.create(name='dev')
+        Worklog.objects.create(
+            work_date=self.day,
+            user_id='1',
+            user_name='dev',
+            hours=2,
+            worklog_system=WorklogSystem.jira,
+            user_profile=self.user,
+        )
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.params = {'from_date': self.day, 'to_date': self.day, 'user': self.user.id}
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_page_has_no_rendered_charts(self):
+        response = self.client.get('/', self.params)
+
+        assert response.status_code == 200
+        assert b'plotly-graph-div' not in response.content
+        assert b'data-chart="tracker"' in response.content
+        assert reverse('dashboard-chart-data').encode() in response.content
+
+    def test_chart_data_served_from_cached_report(self):
+        self.client.get('/', self.params)
+
+        with patch.object(Report, 'calc_report') as calc_report:
+            response = self.client.get(reverse('dashboard-chart-data'), self.params)
+
+        assert not calc_report.called
+        data = response.json()
+        assert data['dates'] == ['2021-03-02']
+        assert data['tracker']['hours'] == [2]
+
+    def test_invalid_params(self):
+        response = self.client.get(reverse('dashboard-chart-data'), {'from_date': 'x'})
+        assert response.status_code == 400
+        assert 'from_date' in response.json()['errors']
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('dashboard-chart-data'), self.params)
+        assert response.status_code == 302
@@ -1,8 +1,11 @@
-from django.test import TestCase
+import time
+
+from django.test import override_settings, TestCase
+from requests_mock import Mocker
 
 from botapp.enums import IssueSystem, ServiceType
-from botapp.models import ServiceAccount, UserProfile
-from botapp.trackers import IssueLoader
+from botapp.models import Issue, ServiceAccount, UserProfile
+from botapp.trackers import get_issue_key_matcher, IssueLoader
 
 
 class TestBatchImport(TestCase):
@@ -35,3 +38,67 @@ class TestBatchImport(TestCase):
     def test_parse_issue7(self):
         issue = IssueLoader().parse_issue('[ABC-193] hello world')
         assert issue is None, issue
+
+    def test_parse_issues(self):
+        issues = IssueLoader().parse_issues('[BACK-1] fix IOS-2, back-1 and ABC-3')
+        assert issues == [(IssueSystem.jira, 'BACK-1'), (IssueSystem.jira, 'IOS-2')], issues
+
+    def test_matcher_rebuilt_on_settings_change(self):
+        matcher = get_issue_key_matcher()
+        assert get_issue_key_matcher() is matcher
+
+        with override_settings(JIRA_PROJECT_KEYS=['ABC']):
+            system, issue_id = IssueLoader().parse_issue('[ABC-193] hello world')
+            assert issue_id == 'ABC-193', issue_id
+
+        assert IssueLoader().parse_issue('[ABC-193] hello world') is None
+
+    def test_parse_issue_benchmark(self):
+        memos = ['[WEB-{}] memo text number {}'.format(i, i) for i in range(50000)]
+        memos += ['meeting with the team number {}'.format(i) for i in range(50000)]
+        loader = IssueLoader()
+
+        started = time.monotonic()
+        parsed = [loader.parse_issue(m) for m in memos]
+        elapsed = time.monotonic() - started
+
+        print('parsed {} memos in {:.3f}s'.format(len(memos), elapsed))
+        assert sum(1 for p in parsed if p) == 50000
+        assert elapsed < 5, elapsed
+
+    def test_prefetch(self):
+        Issue.objects.create(issue_system=IssueSystem.jira, issue_id='BACK-1', title='known')
+        found = {
+            'key': 'IOS-2',
+            'id': '2',
+            'fields': {'summary': 'found', 'description': None, 'labels': []},
+        }
+
+        loader = IssueLoader()
+        with Mocker() as m:
+            m.post('/rest/api/latest/search', json={'issues': [found]})
+            loader.prefetch(['BACK-1 hello', '[ios-2] world', 'WEB-3', '', 'no issue'])
+
+            assert m.call_count == 1, m.call_count
+            assert 'IOS-2, WEB-3' in m.last_request.json()['jql']
+
+            assert loader.get_issue('BACK-1').title == 'known'
+            assert loader.get_issue('IOS-2').title == 'found'
+            assert loader.get_issue('WEB-3') is None
+            assert m.call_count == 1, m.call_count
+
+    def test_missing_issues_cached(self):
+        with Mocker() as m:
+            m.post('/rest/api/latest/search', json={'issues': []})
+            m.get('/rest/api/latest/issue/IOS-404', status_code=404, json={'errorMessages': []})
+
+            IssueLoader().prefetch(['WEB-3'])
+            assert IssueLoader().get_issue('IOS-404') is None
+            assert m.call_count == 2, m.call_count
+
+            loader = IssueLoader()
+            loader.prefetch(['WEB-3', 'IOS-404'])
+            assert loader.get_issue('WEB-3') is None
+            assert loader.get_issue('IOS-404') is None
+            assert m.call_count == 2, m.call_count
+            assert loader.jf.issue_cache.negative_hits == 2
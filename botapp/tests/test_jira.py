@@ -7,7 +7,9 @@ from requests_mock.mocker import Mocker
 
 from fan_tools.python import py_rel_path
 
-from botapp.models import Worklog
+from botapp.enums import WorklogSystem
+from botapp.jira_util import JiraFetcher
+from botapp.models import SyncCursor, Worklog, WorklogDay
 from botapp.trackers import JiraLoader
 
 
@@ -24,10 +26,8 @@ WORKLOG_DATA = json.loads(py_rel_path('./data/list_worklogs.json').read_text())
 
 
 def worklog_callback(req, ctx):
-    resp = WORKLOG_DATA.copy()
     j = json.loads(req.body)
-    resp[0]['id'] = j['ids'][0]
-    return resp
+    return [dict(WORKLOG_DATA[0], id=str(worklog_id)) for worklog_id in j['ids']]
 
 
 @pytest.fixture
@@ -49,6 +49,21 @@ def from_to():
     yield datetime.date(2021, 3, 1), datetime.date(2021, 3, 20)
 
 
+def get_rollup(days):
+    return sorted(
+        (
+            (d.user_profile_id, d.date, d.issue_id, d.worklog_system, d.hours, d.worklog_count)
+            for d in days
+        ),
+        key=repr,
+    )
+
+
+def assert_rollup_consistent():
+    expected = WorklogDay.objects.aggregate_worklogs(Worklog.objects.with_effective_date())
+    assert get_rollup(WorklogDay.objects.all()) == get_rollup(expected)
+
+
 def test_01_parser(from_to):
     jl = JiraLoader()
     jl.sync(*from_to)
@@ -63,3 +78,117 @@ def test_02_skip_deletion(from_to):
     jl.sync(*from_to)
     f.refresh_from_db()
     assert f.remote_updated_at
+
+
+def test_03_sync_summary(from_to):
+    jl = JiraLoader()
+    summary = jl.sync(*from_to)
+    assert (summary.inserted, summary.updated, summary.unchanged) == (8, 0, 0), summary
+
+    summary = jl.sync(*from_to)
+    assert (summary.inserted, summary.updated, summary.unchanged) == (0, 0, 8), summary
+
+    Worklog.objects.filter(uniq_id='10000').update(hours=100, custom_work_date=from_to[0])
+    summary = jl.sync(*from_to)
+    assert (summary.inserted, summary.updated, summary.unchanged) == (0, 1, 7), summary
+    w = Worklog.objects.get(uniq_id='10000')
+    assert w.hours != 100
+    assert w.custom_work_date == from_to[0]
+
+
+def test_04_autocreated_accounts_linked(from_to, monkeypatch):
+    monkeypatch.setattr(JiraLoader, 'autocreate_users', True)
+    JiraLoader().sync(*from_to)
+    assert not Worklog.objects.filter(user_profile__isnull=True).exists()
+
+
+def test_05_stale_worklogs_deleted(from_to):
+    stale = Worklog.objects.create(
+        uniq_id='stale',
+        work_date=from_to[0],
+        user_id='abc',
+        user_name='abc',
+        worklog_system=WorklogSystem.jira,
+    )
+    summary = JiraLoader().sync(*from_to)
+    assert summary.deleted == 1, summary
+    assert not Worklog.objects.filter(id=stale.id).exists()
+    assert Worklog.objects.count() == 8
+    assert_rollup_consistent()
+
+
+def test_06_incremental_sync(from_to, requests_mock):
+    requests_mock.get(
+        '/rest/api/latest/worklog/deleted?since=1614556800000',
+        json={'values': [{'worklogId': 10000}], 'until': 1615000000000, 'lastPage': True},
+    )
+    jl = JiraLoader()
+    summary = jl.sync_incremental(from_to[0])
+    assert (summary.inserted, summary.deleted) == (8, 1), summary
+    assert Worklog.objects.count() == 7
+    assert_rollup_consistent()
+    assert SyncCursor.objects.get(source=jl.updated_cursor).value == 1615461987143
+    assert SyncCursor.objects.get(source=jl.deleted_cursor).value == 1615000000000
+
+    requests_mock.get(
+        '/rest/api/latest/worklog/updated?since=1615461987143',
+        json={'values': [], 'until': 1615461987143, 'lastPage': True},
+    )
+    requests_mock.get(
+        '/rest/api/latest/worklog/deleted?since=1615000000000',
+        json={'values': [], 'until': 1615000000000, 'lastPage': True},
+    )
+    calls = requests_mock.call_count
+    summary = JiraLoader().sync_incremental(from_to[0])
+    assert summary.total == 0, summary
+    assert requests_mock.call_count == calls + 2
+    assert Worklog.objects.count() == 7
+
+
+def test_07_worklogs_listed_in_batch(from_to, requests_mock):
+    JiraLoader().sync(*from_to)
+    list_calls = [r for r in requests_mock.request_history if r.path.endswith('/worklog/list')]
+    assert len(list_calls) == 1
+    assert len(list_calls[0].json()['ids']) == 8
+
+
+def test_08_issue_fetch_retried_on_rate_limit(requests_mock):
+    requests_mock.get(
+        '/rest/api/latest/issue/BACK-1',
+        [
+            {'status_code': 429, 'headers': {'Retry-After': '0'}},
+            {'json': {'key': 'BACK-1', 'fields': {}}},
+        ],
+    )
+    assert JiraFetcher().fetch_jira_issue('BACK-1')['key'] == 'BACK-1'
+    assert requests_mock.call_count == 2
+
+
+def test_09_issue_cache_shared_between_fetchers(requests_mock):
+    requests_mock.get(
+        '/rest/api/latest/issue/BACK-1', json={'id': '101', 'key': 'BACK-1', 'fields': {}}
+    )
+    JiraFetcher().fetch_jira_issue('BACK-1')
+    assert JiraFetcher().fetch_jira_issue('back-1')['key'] == 'BACK-1'
+    assert JiraFetcher().fetch_jira_issue('101')['key'] == 'BACK-1'
+    assert requests_mock.call_count == 1
+
+
+def test_10_rollup_follows_moved_worklog(from_to):
+    JiraLoader().sync(*from_to)
+    assert WorklogDay.objects.count() > 0
+    assert_rollup_consistent()
+
+    # moved out of the synced range in teambot, the remote version differs from the stored one
+    moved_date = datetime.date(2021, 4, 15)
+    worklog = Worklog.objects.first()
+    worklog.custom_work_date = moved_date
+    worklog.save()
+    Worklog.objects.filter(id=worklog.id).update(hours=100)
+    WorklogDay.objects.refresh([moved_date])
+    assert WorklogDay.objects.get(date=moved_date).hours == 100
+
+    summary = JiraLoader().sync(*from_to)
+    assert summary.updated == 1, summary
+    assert_rollup_consistent()
+    assert WorklogDay.objects.get(date=moved_date).hours != 100
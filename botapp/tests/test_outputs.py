@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from botapp.outputs import SLACK_ATTACHMENT_TEXT_LIMIT, SlackSchedulesStatusOutput
+from gitapp.git_utils import ScheduleStatus
+from gitapp.models import GitProject
+
+
+def make_status(i, status):
+    project = GitProject(project_id=str(i), name='project-{}'.format(i))
+    schedule = {'id': i, 'description': 'nightly', 'last_pipeline': {'id': i, 'status': status}}
+    return ScheduleStatus(project, schedule, 'http://gitlab/project-{}'.format(i))
+
+
+@patch('botapp.outputs.post_slack_message')
+def test_schedule_statuses_sent_in_single_post(post):
+    statuses = [make_status(i, 'failed' if i % 3 else 'success') for i in range(600)]
+    statuses.append(make_status(600, 'canceled'))
+
+    SlackSchedulesStatusOutput().send_message(statuses, {'slack_channel': '#ci'})
+
+    assert post.call_count == 1
+    attachments = post.call_args[1]['attachments']
+    assert [a['title'] for a in attachments] == [
+        'Scheduled tests have failed (400)',
+        'Scheduled tests have passed successfully (200)',
+    ]
+    for a in attachments:
+        assert len(a['text']) <= SLACK_ATTACHMENT_TEXT_LIMIT + 20
+    assert attachments[0]['text'].startswith(
+        '<http://gitlab/project-1/pipelines/1|project-1 #1> nightly\n'
+    )
+    assert attachments[0]['text'].endswith('more')
+
+
+@patch('botapp.outputs.post_slack_message')
+def test_nothing_sent_without_pipelines(post):
+    SlackSchedulesStatusOutput().send_message([], {'slack_channel': '#ci'})
+    assert not post.called
+
+
+def test_status_without_url_has_no_link():
+    status = make_status(1, 'failed')
+    status.project_url = ''
+    assert SlackSchedulesStatusOutput().format_line(status) == 'project-1 #1 nightly'
@@ -0,0 +1,98 @@
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from botapp.outputs import post_slack_message
+from teambot import transport
+
+
+@pytest.fixture(autouse=True)
+def reset_transport():
+    transport.reset()
+    yield
+    transport.reset()
+
+
+@pytest.fixture
+def sleep():
+    with patch('teambot.transport.time.sleep') as sleep:
+        yield sleep
+
+
+def test_session_shared_per_host():
+    session = transport.get_session('https://a.example/x')
+    assert transport.get_session('https://a.example/y') is session
+    assert transport.get_session('https://b.example/x') is not session
+
+
+def test_server_errors_retried_with_backoff(requests_mock, sleep, settings):
+    settings.HTTP_BACKOFF_FACTOR = 0.5
+    requests_mock.get(
+        'https://a.example/x', [{'status_code': 502}, {'status_code': 503}, {'json': {'ok': True}}]
+    )
+    assert transport.get('https://a.example/x').json() == {'ok': True}
+    assert [c[0][0] for c in sleep.call_args_list] == [0.5, 1.0]
+
+    stats = transport.get_stats()['https://a.example']
+    assert (stats.requests, stats.retries, stats.errors) == (1, 2, 2)
+
+
+def test_last_response_returned_after_retries(requests_mock, sleep):
+    requests_mock.get('https://a.example/x', status_code=500)
+    assert transport.get('https://a.example/x', retries=2).status_code == 500
+    assert requests_mock.call_count == 3
+
+
+def test_connection_error_raised_after_retries(requests_mock, sleep):
+    requests_mock.get('https://a.example/x', exc=requests.ConnectTimeout)
+    with pytest.raises(requests.ConnectTimeout):
+        transport.get('https://a.example/x', retries=1)
+    assert requests_mock.call_count == 2
+
+
+def test_timeout_passed(requests_mock, settings):
+    settings.HTTP_CONNECT_TIMEOUT = 3
+    settings.HTTP_READ_TIMEOUT = 30
+    requests_mock.get('https://a.example/x')
+    transport.get('https://a.example/x')
+    assert requests_mock.last_request.timeout == (3, 30)
+
+
+def test_slack_error_raised(requests_mock, monkeypatch):
+    monkeypatch.setenv('SLACK_TOKEN', 'xoxb-token')
+    requests_mock.post(
+        'https://slack.com/api/chat.postMessage', json={'ok': False, 'error': 'channel_not_found'}
+    )
+    with pytest.raises(Exception, match='channel_not_found'):
+        post_slack_message(channel='#nope', text='hi')
+    assert requests_mock.last_request.headers['Authorization'] == 'Bearer xoxb-token'
+
+
+def test_slack_post_not_repeated_after_it_was_sent(requests_mock, sleep, monkeypatch):
+    monkeypatch.setenv('SLACK_TOKEN', 'xoxb-token')
+    url = 'https://slack.com/api/chat.postMessage'
+
+    requests_mock.post(url, status_code=503, json={'ok': False})
+    with pytest.raises(Exception):
+        post_slack_message(channel='#dev', text='hi')
+    assert requests_mock.call_count == 1
+
+    requests_mock.post(url, exc=requests.ReadTimeout)
+    with pytest.raises(requests.ReadTimeout):
+        post_slack_message(channel='#dev', text='hi')
+    assert requests_mock.call_count == 2
+
+
+def test_slack_post_retried_when_not_processed(requests_mock, sleep, monkeypatch):
+    monkeypatch.setenv('SLACK_TOKEN', 'xoxb-token')
+    requests_mock.post(
+        'https://slack.com/api/chat.postMessage',
+        [
+            {'exc': requests.ConnectTimeout},
+            {'status_code': 429, 'headers': {'Retry-After': '1'}},
+            {'json': {'ok': True}},
+        ],
+    )
+    assert post_slack_message(channel='#dev', text='hi') == {'ok': True}
+    assert requests_mock.call_count == 3
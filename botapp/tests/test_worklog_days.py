@@ -0,0 +1,135 @@
+import threading
+import time
+from datetime import date
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+
+from botapp.actions import IssueAction, ReportAction
+from botapp.enums import IssueSystem, WorklogSystem
+from botapp.models import Issue, Tag, Team, UserProfile, Worklog, WorklogDay
+
+
+class TestWorklogDays(TestCase):
+    day = date(2021, 3, 2)
+
+    def setUp(self):
+        self.dev = UserProfile.objects.create(name='dev')
+        self.issue = Issue.objects.create(
+            issue_system=IssueSystem.jira, issue_id='BACK-1', title='t', tags=['sdk']
+        )
+
+    def add_worklog(self, hours, description='work', **kwargs):
+        return Worklog.objects.create(
+            work_date=self.day,
+            user_id='1',
+            user_name='dev',
+            hours=hours,
+            description=description,
+            worklog_system=WorklogSystem.jira,
+            user_profile=self.dev,
+            issue=self.issue,
+            **kwargs,
+        )
+
+    def test_saved_worklogs_summed(self):
+        self.add_worklog(2)
+        self.add_worklog(1.5, description='')
+
+        day = WorklogDay.objects.get()
+        assert (day.date, day.user_profile, day.issue) == (self.day, self.dev, self.issue)
+        assert (day.hours, day.worklog_count, day.undescribed_hours) == (3.5, 2, 1.5)
+
+    def test_moved_and_deleted_worklog(self):
+        worklog = self.add_worklog(2)
+        worklog.custom_work_date = date(2021, 3, 5)
+        worklog.save()
+        assert list(WorklogDay.objects.values_list('date', 'hours')) == [(date(2021, 3, 5), 2)]
+
+        worklog.delete()
+        assert not WorklogDay.objects.exists()
+
+    def test_rebuild_command(self):
+        self.add_worklog(2)
+        self.add_worklog(1)
+        WorklogDay.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_worklog_days', stdout=out)
+
+        assert 'Rebuilt 1 worklog days' in out.getvalue()
+        assert WorklogDay.objects.get().hours == 3
+
+    def test_reports_read_rollup(self):
+        team = Team.objects.create(name='backend', default=True)
+        team.user_profiles.add(self.dev)
+        self.add_worklog(2)
+        self.add_worklog(1.5, description='')
+        # changed behind the rollup, reports must keep showing the rolled up hours
+        Worklog.objects.update(hours=100)
+
+        with patch.object(ReportAction, 'send_message') as send_message:
+            ReportAction().handle_dates(self.day, self.day, {})
+        users = send_message.call_args[0][0]
+        assert [(u.name, u.total_hours) for u in users] == [('dev', 3.5)]
+
+        msg = IssueAction().handle_dates(self.day, self.day, {})
+        assert 'dev....1.5h' in msg
+
+        Tag.objects.create(name='sdk', use_tag=True)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get('/tags_time/', {'month': '2021-04'})
+        assert response.context['teams'] == ['backend', 'No Team']
+        assert response.context['tags'] == {'sdk': [3.5, 0]}
+
+
+class TestConcurrentRefresh(TransactionTestCase):
+    day = date(2021, 3, 2)
+
+    def wait_for_blocked_query(self):
+        with connection.cursor() as cursor:
+            for i in range(100):
+                cursor.execute('SELECT count(*) FROM pg_locks WHERE NOT granted')
+                if cursor.fetchone()[0]:
+                    return
+                time.sleep(0.05)
+        self.fail('second refresh was not blocked')
+
+    def test_overlapping_refreshes_leave_one_row_per_key(self):
+        Worklog.objects.create(
+            work_date=self.day,
+            user_id='1',
+            user_name='dev',
+            hours=2,
+            worklog_system=WorklogSystem.jira,
+        )
+        first_refreshed = threading.Event()
+        commit_first = threading.Event()
+
+        def refresh(refreshed=None, commit=None):
+            try:
+                with transaction.atomic():
+                    WorklogDay.objects.refresh([self.day])
+                    if refreshed:
+                        refreshed.set()
+                        commit.wait(5)
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=refresh, args=(first_refreshed, commit_first))
+        first.start()
+        first_refreshed.wait(5)
+        second = threading.Thread(target=refresh)
+        second.start()
+
+        self.wait_for_blocked_query()
+        commit_first.set()
+        first.join()
+        second.join()
+
+        assert list(WorklogDay.objects.values_list('date', 'hours')) == [(self.day, 2)]
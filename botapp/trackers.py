@@ -2,22 +2,25 @@ import logging
 import os
 import re
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
 from functools import cached_property
 from typing import Iterator, Optional, Tuple, Union
 
 import pytz
-import requests
 import upwork
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django_orm_sugar import Q
 
+from botapp import report_cache
 from botapp.enums import IssueSystem, ServiceType, WorklogSystem
 from botapp.factories import ServiceAccountFactory
 from botapp.jira_util import JiraFetcher
-from botapp.models import Issue, ServiceAccount, UserProfile, Worklog
+from botapp.models import Issue, ServiceAccount, SyncCursor, UserProfile, Worklog, WorklogDay
+from teambot import transport
 
 
 @dataclass
@@ -32,16 +35,166 @@ class WorklogInfo:
     remote_updated_at: Optional[datetime] = field(default=None)
 
 
+@dataclass
+class SyncSummary:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    # lookups of unknown or inaccessible Jira issues served from the negative cache
+    negative_hits: int = 0
+
+    @property
+    def total(self):
+        return self.inserted + self.updated + self.unchanged
+
+    def __str__(self):
+        return (
+            'synced {} worklogs: {} inserted, {} updated, {} unchanged, {} skipped, {} deleted, '
+            '{} missing issue hits'
+        ).format(
+            self.total,
+            self.inserted,
+            self.updated,
+            self.unchanged,
+            self.skipped,
+            self.deleted,
+            self.negative_hits,
+        )
+
+
+class ServiceAccountMap:
+    """
+    uid -> UserProfile map of service accounts, it's loaded once per sync run
+    """
+
+    def __init__(self, service_type):
+        self.service_type = service_type
+        self.profiles = {}
+        self.loaded = False
+
+    def load(self):
+        qs = ServiceAccount.objects.filter(service_type=self.service_type)
+        for account in qs.select_related('user_profile'):
+            self.profiles[account.uid] = account.user_profile
+        self.loaded = True
+
+    def prefetch(self, uids):
+        """
+        Fetch accounts which were not seen yet (e.g. created during the sync) in one query
+        """
+        if not self.loaded:
+            self.load()
+
+        missing = set(str(uid) for uid in uids) - self.profiles.keys()
+        if not missing:
+            return
+
+        qs = ServiceAccount.objects.filter(service_type=self.service_type, uid__in=missing)
+        for account in qs.select_related('user_profile'):
+            self.profiles[account.uid] = account.user_profile
+
+        # remember unknown accounts, so they are not requested again
+        for uid in missing - self.profiles.keys():
+            self.profiles[uid] = None
+
+    def get(self, uid):
+        return self.profiles.get(str(uid))
+
+
+class IssueKeyMatcher:
+    """
+    Compiled matcher of issue keys of the given Jira projects
+    """
+
+    def __init__(self, project_keys):
+        self.project_keys = tuple(project_keys)
+        pattern = r'(?:{})-\d+'.format('|'.join(re.escape(k) for k in self.project_keys))
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+    def search(self, text):
+        matched = self.regex.search(text)
+        if matched:
+            return matched.group(0).upper()
+
+    def findall(self, text):
+        return list(dict.fromkeys(k.upper() for k in self.regex.findall(text)))
+
+
+_issue_key_matcher = None
+
+
+def get_issue_key_matcher():
+    """
+    Matcher is rebuilt only when JIRA_PROJECT_KEYS setting is changed
+    """
+    global _issue_key_matcher
+    project_keys = tuple(settings.JIRA_PROJECT_KEYS)
+    if _issue_key_matcher is None or _issue_key_matcher.project_keys != project_keys:
+        _issue_key_matcher = IssueKeyMatcher(project_keys)
+    return _issue_key_matcher
+
+
 class IssueLoader:
     def __init__(self, autoupdate=False):
         self.issues_dict = {}
         self.autoupdate = autoupdate
 
+    @cached_property
+    def jf(self):
+        return JiraFetcher()
+
     def parse_issue(self, description):
-        pattern = r'|'.join([r'({}-\d+)'.format(t) for t in settings.JIRA_PROJECT_KEYS])
-        matched = re.search(pattern, description, re.IGNORECASE)
-        if matched:
-            return IssueSystem.jira, matched.group(0).upper()
+        issue_id = get_issue_key_matcher().search(description)
+        if issue_id:
+            return IssueSystem.jira, issue_id
+
+    def parse_issues(self, description):
+        return [(IssueSystem.jira, k) for k in get_issue_key_matcher().findall(description)]
+
+    def prefetch(self, memos):
+        """
+        Load issues of all memos at once: known issues with a single query, the missing
+        ones with a few Jira searches. Following get_issue calls are served from memory.
+        """
+        keys = set()
+        for memo in memos:
+            issue_tuple = self.parse_issue(memo or '')
+            if issue_tuple and issue_tuple not in self.issues_dict:
+                keys.add(issue_tuple[1])
+        if not keys:
+            return
+
+        issues = {
+            i.issue_id: i
+            for i in Issue.objects.filter(issue_system=IssueSystem.jira, issue_id__in=keys)
+        }
+        # existing issues are refreshed from Jira only with autoupdate
+        remote_keys = keys if self.autoupdate else keys - issues.keys()
+        cached = {k: self.jf.issue_cache.get(k) for k in remote_keys}
+        # negative cache entries are error payloads without fields
+        missing = set(k for k, j in cached.items() if j is not None and 'fields' not in j)
+        not_cached = sorted(k for k, j in cached.items() if j is None)
+        if not_cached:
+            found = set(j['key'] for j in self.jf.search_jira_issues(not_cached))
+            missing |= set(not_cached) - found
+        remote_keys = remote_keys - missing
+
+        for key in keys:
+            issue = issues.get(key)
+            if key in remote_keys:
+                if issue:
+                    self.jf.update_jira_issue(issue, key)
+                else:
+                    issue = self.jf.create_jira_issue(key)
+            self.issues_dict[IssueSystem.jira, key] = issue
+
+    def prefetch_failsafe(self, memos):
+        try:
+            self.prefetch(memos)
+        except Exception as e:
+            logging.exception(e)
 
     def get_issue_failsafe(self, memo):
         try:
@@ -57,20 +210,18 @@ class IssueLoader:
         if issue_tuple:
             issue_system, issue_id = issue_tuple
 
-            # try cached issue
-            issue = self.issues_dict.get(issue_tuple)
-            if issue:
-                print('found cached issue: {}'.format(issue_id))
-                return issue
+            # try cached issue, None is cached for unknown keys
+            if issue_tuple in self.issues_dict:
+                return self.issues_dict[issue_tuple]
 
             if issue_system == IssueSystem.jira:
                 issue = Issue.objects.filter(issue_system=issue_system, issue_id=issue_id).first()
 
                 if issue:
                     if self.autoupdate:
-                        JiraFetcher().update_jira_issue(issue, issue_id)
+                        self.jf.update_jira_issue(issue, issue_id)
                 else:
-                    issue = JiraFetcher().create_jira_issue(issue_id)
+                    issue = self.jf.create_jira_issue(issue_id)
 
                 # cache issue
                 self.issues_dict[issue_tuple] = issue
@@ -83,6 +234,8 @@ class BaseWorklogLoader(ABC):
     service_type: ServiceType
     log = logging.getLogger('django.server')
     drop_old = False
+    # number of worklogs written with a single upsert statement
+    batch_size = 500
 
     def __init__(self, command=None):
         self.command = command
@@ -102,65 +255,114 @@ class BaseWorklogLoader(ABC):
     def sync(self, from_date, to_date):
         report = self.fetch_team_report(from_date, to_date)
         if report is not None:
-            self.sync_fetched_report(from_date, to_date, report)
+            return self.sync_fetched_report(from_date, to_date, report)
 
-    def sync_fetched_report(self, from_date, to_date, report):
+    def sync_fetched_report(self, from_date, to_date, report, partial=False):
+        """
+        :param partial: report has only changed worklogs, nothing else is deleted in the range
+        """
         self.log.info(
             'Sync report {} from {} to {}'.format(self.worklog_system.name, from_date, to_date)
         )
 
-        batch = []
+        summary = SyncSummary()
+        synced_ids = set()
 
-        if self.drop_old:
-            Worklog.objects.between(from_date, to_date).filter(
-                Q.worklog_system == self.worklog_system
-            ).delete()
+        with transaction.atomic():
+            # effective dates of written worklogs, old and new
+            self.changed_dates = set()
 
-        issue_loader = IssueLoader(autoupdate=True)
-        for info in self.iter_fetched_report(report):
-            service_account = ServiceAccount.objects.filter(
-                service_type=self.service_type, uid=info.user_id
-            ).first()
+            if self.drop_old:
+                summary.deleted = self.delete_worklogs(
+                    Worklog.objects.between(from_date, to_date).filter(
+                        Q.worklog_system == self.worklog_system
+                    )
+                )
 
-            user_profile = service_account.user_profile if service_account else None
+            self.issue_loader = IssueLoader(autoupdate=True)
+            self.accounts = ServiceAccountMap(self.service_type)
+            self.accounts.load()
 
-            issue = issue_loader.get_issue_failsafe(info.memo)
+            chunk = {}
+            for info in self.iter_fetched_report(report):
+                if info.work_date < from_date or info.work_date > to_date:
+                    print(
+                        f'SKIP: {info.user_name} {info.memo} {info.work_date=} {from_date=} {to_date=}'
+                    )
+                    summary.skipped += 1
+                    continue
 
-            if info.work_date < from_date or info.work_date > to_date:
-                print(
-                    f'SKIP: {info.user_name} {info.memo} {info.work_date=} {from_date=} {to_date=}'
-                )
-                continue
-
-            defaults = dict(
-                work_date=info.work_date,
-                user_id=info.user_id,
-                user_name=info.user_name,
-                hours=info.hours,
-                description=info.memo,
-                issue=issue,
-                from_datetime=info.dt_range[0],
-                to_datetime=info.dt_range[1],
-                worklog_system=self.worklog_system,
-                user_profile=user_profile,
-                remote_updated_at=info.remote_updated_at,
-            )
-            worklog, created = Worklog.objects.update_or_create(
-                uniq_id=info.uniq_id, defaults=defaults
-            )
-            self.log.info(f'worklog: {info}')
-            batch.append(worklog)
-        if not self.drop_old:
-            all_worklogs = Worklog.objects.between(from_date, to_date).filter(
-                Q.worklog_system == self.worklog_system
-            )
-            ids = set(x.id for x in batch)
+                self.log.info(f'worklog: {info}')
 
-            for wl in all_worklogs:
-                if wl.id not in ids:
-                    wl.delete()
+                if info.uniq_id is None:
+                    # rows without remote id can't collide with each other
+                    chunk[id(info)] = info
+                else:
+                    # the same remote worklog may come twice, the latest version wins
+                    info.uniq_id = str(info.uniq_id)
+                    chunk[info.uniq_id] = info
+                    synced_ids.add(info.uniq_id)
+
+                if len(chunk) >= self.batch_size:
+                    self.write_chunk(list(chunk.values()), summary)
+                    chunk = {}
+
+            self.write_chunk(list(chunk.values()), summary)
+            summary.negative_hits = self.issue_loader.jf.issue_cache.negative_hits
+
+            if not self.drop_old and not partial:
+                # worklogs removed in the remote system
+                summary.deleted = self.delete_worklogs(
+                    Worklog.objects.between(from_date, to_date)
+                    .filter(Q.worklog_system == self.worklog_system)
+                    .exclude(uniq_id__in=synced_ids)
+                )
 
-        print('synced {} worklogs'.format(len(batch)))
+            if summary.inserted or summary.updated or summary.deleted:
+                WorklogDay.objects.refresh(self.changed_dates)
+                report_cache.bump_data_version(report_cache.WORKLOGS)
+
+        print(summary)
+        return summary
+
+    def delete_worklogs(self, worklogs):
+        self.changed_dates.update(worklogs.effective_dates())
+        deleted, _ = worklogs.delete()
+        return deleted
+
+    def write_chunk(self, infos, summary):
+        if not infos:
+            return
+
+        self.accounts.prefetch(info.user_id for info in infos)
+        self.issue_loader.prefetch_failsafe(info.memo for info in infos)
+
+        worklogs = [self.create_worklog(info) for info in infos]
+        # an update may move a worklog from a date outside of the range, custom dates are kept
+        uniq_ids = [w.uniq_id for w in worklogs if w.uniq_id is not None]
+        self.changed_dates.update(Worklog.objects.filter(uniq_id__in=uniq_ids).effective_dates())
+        self.changed_dates.update(w.work_date for w in worklogs)
+
+        inserted, updated = Worklog.objects.upsert(worklogs)
+        summary.inserted += inserted
+        summary.updated += updated
+        summary.unchanged += len(worklogs) - inserted - updated
+
+    def create_worklog(self, info: WorklogInfo):
+        return Worklog(
+            uniq_id=info.uniq_id,
+            work_date=info.work_date,
+            user_id=info.user_id,
+            user_name=info.user_name,
+            hours=info.hours,
+            description=info.memo,
+            issue=self.issue_loader.get_issue_failsafe(info.memo),
+            from_datetime=info.dt_range[0],
+            to_datetime=info.dt_range[1],
+            worklog_system=self.worklog_system,
+            user_profile=self.accounts.get(info.user_id),
+            remote_updated_at=info.remote_updated_at,
+        )
 
     @abstractmethod
     def iter_fetched_report(self, report) -> Iterator[WorklogInfo]:
@@ -269,7 +471,7 @@ class SMonLoader(BaseWorklogLoader):
             data.append({"employmentId": s.uid, "from": from_timestamp, "to": to_timestamp})
 
         if data:
-            r = requests.post(
+            r = transport.post(
                 'https://screenshotmonitor.com/api/v2/GetActivities', json=data, headers=headers
             )
             if r.status_code == 200:
@@ -304,6 +506,9 @@ class JiraLoader(BaseWorklogLoader):
     service_type = ServiceType.jira
     autocreate_users = os.environ.get('JIRA_AUTOCREATE_USERS', '0') == '1'
 
+    updated_cursor = 'jira-worklogs-updated'
+    deleted_cursor = 'jira-worklogs-deleted'
+
     @cached_property
     def jf(self):
         return JiraFetcher()
@@ -314,6 +519,41 @@ class JiraLoader(BaseWorklogLoader):
         report = list(self.jf.fetch_worklogs(start, end))
         return report
 
+    def sync_incremental(self, from_date):
+        """
+        Sync worklogs changed or deleted since the previous incremental run.
+
+        :param from_date: start of the range for the very first run, when there is no cursor yet
+        """
+        default_since = int(datetime.fromordinal(from_date.toordinal()).timestamp() * 1000)
+        updated, _ = SyncCursor.objects.get_or_create(source=self.updated_cursor)
+        deleted, _ = SyncCursor.objects.get_or_create(source=self.deleted_cursor)
+
+        since = updated.value or default_since
+        report, updated.value = self.jf.fetch_updated_worklogs(since)
+        deleted_ids, deleted.value = self.jf.fetch_deleted_worklog_ids(
+            deleted.value or default_since
+        )
+
+        from_date = datetime.fromtimestamp(since / 1000, tz=timezone.utc).date()
+        to_date = timezone.now().date()
+        with transaction.atomic():
+            summary = self.sync_fetched_report(from_date, to_date, report, partial=True)
+            self.changed_dates = set()
+            summary.deleted = self.delete_worklogs(
+                Worklog.objects.filter(
+                    Q.worklog_system == self.worklog_system, uniq_id__in=deleted_ids
+                )
+            )
+            if summary.deleted:
+                WorklogDay.objects.refresh(self.changed_dates)
+                report_cache.bump_data_version(report_cache.WORKLOGS)
+            updated.save()
+            deleted.save()
+
+        print('deleted {} worklogs'.format(summary.deleted))
+        return summary
+
     def create_users(self, users):
         for uid, name in users.items():
             ServiceAccountFactory(uid=uid, service_type=ServiceType.jira, user_profile__name=name)
@@ -326,21 +566,34 @@ class JiraLoader(BaseWorklogLoader):
             }
             self.create_users(users)
 
-        for item in report:
-            print(f'Item: {item}')
-            remote_updated_at = datetime.strptime(
-                item['updated'], '%Y-%m-%dT%H:%M:%S.%f%z'
-            ).astimezone(pytz.utc)
-            work_date = remote_updated_at.date()
-            user_id = item['updateAuthor']['accountId']
-            user_name = item['updateAuthor']['displayName']
-            hours = float(item['timeSpentSeconds'] / 60 / 60)
-            issue = self.jf.fetch_jira_issue(item['issueId'])
-            memo = issue['key']
-            if comment := item.get('comment'):
-                memo += f': {comment}'
+        for i in range(0, len(report), self.batch_size):
+            page = report[i : i + self.batch_size]
+            issues = self.prefetch_jira_issues(page)
+            for item in page:
+                yield self.create_worklog_info(item, issues[item['issueId']])
 
-            dt_range = (None, None)
-            yield WorklogInfo(
-                item['id'], user_id, user_name, work_date, hours, memo, dt_range, remote_updated_at
-            )
+    def prefetch_jira_issues(self, items):
+        """
+        Fetch distinct issues of report items in parallel, at most JIRA_CONCURRENCY at once
+        """
+        issue_ids = list(dict.fromkeys(item['issueId'] for item in items))
+        with ThreadPoolExecutor(max_workers=settings.JIRA_CONCURRENCY) as executor:
+            return dict(zip(issue_ids, executor.map(self.jf.fetch_jira_issue, issue_ids)))
+
+    def create_worklog_info(self, item, issue):
+        print(f'Item: {item}')
+        remote_updated_at = datetime.strptime(item['updated'], '%Y-%m-%dT%H:%M:%S.%f%z').astimezone(
+            pytz.utc
+        )
+        work_date = remote_updated_at.date()
+        user_id = item['updateAuthor']['accountId']
+        user_name = item['updateAuthor']['displayName']
+        hours = float(item['timeSpentSeconds'] / 60 / 60)
+        memo = issue['key']
+        if comment := item.get('comment'):
+            memo += f': {comment}'
+
+        dt_range = (None, None)
+        return WorklogInfo(
+            item['id'], user_id, user_name, work_date, hours, memo, dt_range, remote_updated_at
+        )
@@ -1,17 +1,20 @@
 from collections import defaultdict
 from datetime import date, datetime, timedelta
 
-import plotly.graph_objs as go
-import plotly.offline as opy
 from dateutil.relativedelta import relativedelta
 from django import forms
 from django.contrib.auth.decorators import login_required
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views import View
 from django_orm_sugar import Q
 
-from botapp.models import Tag, Team, UserProfile, Worklog
+from botapp.models import Tag, Team, UserProfile, Worklog, WorklogDay
+from botapp.report_cache import get_cached_report
 from gitapp.models import GitCommit
 
 
@@ -57,10 +60,11 @@ class Report:
         self.issues_list = []
 
         self.tracker_worklogs = []
-        self.tracker_chart = ''
+        self.tracker_hours = {}
 
         self.gitlab_commits = []
-        self.gitlab_chart = ''
+        self.gitlab_changes = {}
+
         self.summary = []
 
         self.calc_report()
@@ -71,24 +75,22 @@ class Report:
 
         self.calc_summary()
 
-        self.create_tracker_report()
-        self.create_gitlab_report()
-
     def calc_summary(self):
         for i, date in enumerate(self.dates_list):
             grouped_worklogs = self.get_grouped_worklogs(self.tracker_worklogs[i])
             commits = self.gitlab_commits[i]
+            adds, dels = self.gitlab_changes.get(date, (0, 0))
             d = {
                 'date': date,
                 'is_weekend': date.weekday() == 5 or date.weekday() == 6,
                 'gitlab_commits': commits,
                 'gitlab_text': [c.title for c in commits],
-                'gitlab_adds': sum([c.additions or 0 for c in commits]),
-                'gitlab_dels': sum([-c.deletions or 0 for c in commits]),
+                'gitlab_adds': adds or 0,
+                'gitlab_dels': -(dels or 0),
                 'tracker_worklogs': self.tracker_worklogs[i],
                 'tracker_grouped_worklogs': grouped_worklogs,
                 'tracker_text': [w.description for w in grouped_worklogs],
-                'tracker_hours': sum([w.hours for w in grouped_worklogs]),
+                'tracker_hours': self.tracker_hours.get(date, 0),
             }
             self.summary.append(d)
 
@@ -102,20 +104,23 @@ class Report:
                 groups[text] = GroupedWorklog(w)
         return sorted(groups.values(), key=lambda w: w.hours, reverse=True)
 
-    def create_tracker_report(self):
-        hours = [d['tracker_hours'] for d in self.summary]
-        texts = ['<br>'.join(map(str, d['tracker_text'])) for d in self.summary]
-        trace1 = go.Bar(x=self.dates_list, y=hours, text=texts, name='hours')
-
-        data = go.Data([trace1])
-        layout = go.Layout(
-            title='Logged Work Time', xaxis={'range': [self.from_date, self.to_date]}
-        )
-        figure = go.Figure(data=data, layout=layout)
-
-        self.tracker_chart = opy.plot(
-            figure, auto_open=False, output_type='div', include_plotlyjs=False
-        )
+    def get_chart_data(self):
+        """
+        Series of the tracker and gitlab charts, they are drawn in the browser
+        """
+        return {
+            'range': [self.from_date.isoformat(), self.to_date.isoformat()],
+            'dates': [d.isoformat() for d in self.dates_list],
+            'tracker': {
+                'hours': [d['tracker_hours'] for d in self.summary],
+                'text': ['<br>'.join(map(str, d['tracker_text'])) for d in self.summary],
+            },
+            'gitlab': {
+                'additions': [d['gitlab_adds'] for d in self.summary],
+                'deletions': [d['gitlab_dels'] for d in self.summary],
+                'text': ['<br>'.join(map(str, d['gitlab_text'])) for d in self.summary],
+            },
+        }
 
     def get_commit_name(self, c):
         return '[{}] {}'.format(c.issue.issue_id, c.issue.title) if c.issue else c.title
@@ -125,61 +130,146 @@ class Report:
             Q.created_at.date >= self.from_date,
             Q.created_at.date <= self.to_date,
             (Q.author_profile == self.user_profile) | (Q.committer_profile == self.user_profile),
-        )
+        ).annotate(day=TruncDate('created_at'))
 
-        commits_dict = {}
+        # day -> (additions, deletions)
+        changes = qs.order_by().values_list('day').annotate(Sum('additions'), Sum('deletions'))
+        self.gitlab_changes = {day: (adds, dels) for day, adds, dels in changes}
 
-        for commit in qs:
-            k = commit.created_at.date()
-            if commits_dict.get(k) is None:
-                commits_dict[k] = [commit]
-
-            else:
-                commits_dict[k].append(commit)
+        commits_dict = defaultdict(list)
+        for commit in qs.select_related('issue', 'project').order_by('created_at'):
+            commits_dict[commit.day].append(commit)
 
         for k in self.dates_list:
             self.gitlab_commits.append(commits_dict.get(k, []))
 
     def calc_tracker_stats(self):
+        hours = (
+            WorklogDay.objects.between(self.from_date, self.to_date)
+            .filter(user_profile=self.user_profile)
+            .order_by()
+            .values_list('date')
+            .annotate(Sum('hours'))
+        )
+        self.tracker_hours = dict(hours)
+
         qs = (
             Worklog.objects.between(self.from_date, self.to_date)
             .filter(user_profile=self.user_profile)
-            .order_by('work_date', 'from_datetime')
+            .with_effective_date()
         )
 
-        worklog_dict = {}
-        for w in qs:
-            k = w.work_date
-            if worklog_dict.get(k) is None:
-                worklog_dict[k] = [w]
-
-            else:
-                worklog_dict[k].append(w)
+        worklog_dict = defaultdict(list)
+        for w in qs.select_related('issue').order_by('effective_date', 'from_datetime'):
+            worklog_dict[w.effective_date].append(w)
 
         for k in self.dates_list:
             self.tracker_worklogs.append(worklog_dict.get(k, []))
 
-    def create_gitlab_report(self):
-        adds = [d['gitlab_adds'] for d in self.summary]
-        dels = [d['gitlab_dels'] for d in self.summary]
-        texts = ['<br>'.join(map(str, d['gitlab_text'])) for d in self.summary]
 
-        trace1 = go.Bar(
-            x=self.dates_list, y=adds, text=texts, name='Additions', marker={'color': 'green'}
-        )
-        trace2 = go.Bar(x=self.dates_list, y=dels, name='Deletions')
-
-        data = go.Data([trace1, trace2])
-        layout = go.Layout(
-            title='Gitlab',
-            barmode='relative',
-            showlegend=False,
-            xaxis={'range': [self.from_date, self.to_date]},
+class TeamReport:
+    """
+    Daily hours and code changes of all team members side by side. Worklogs and commits
+    are aggregated by one grouped query each, so the number of queries doesn't depend on
+    the team size.
+    """
+
+    def __init__(self, team, from_date, to_date):
+        self.team = team
+        self.from_date = from_date
+        self.to_date = to_date
+
+        self.members = list(team.user_profiles.order_by('name'))
+        self.dates_list = sorted(iterate_dates(self.from_date, self.to_date), reverse=True)
+
+        # (user profile id, date) -> hours
+        self.tracker_hours = {}
+        # (user profile id, date) -> [additions, deletions]
+        self.gitlab_changes = {}
+
+        self.summary = []
+        self.totals = []
+
+        self.calc_report()
+
+    def calc_report(self):
+        if self.members:
+            self.calc_tracker_stats()
+            self.calc_gitlab_stats()
+
+        self.calc_summary()
+
+    def calc_tracker_stats(self):
+        qs = (
+            WorklogDay.objects.between(self.from_date, self.to_date)
+            .filter(user_profile__in=self.members)
+            .order_by()
+            .values_list('user_profile', 'date')
+            .annotate(Sum('hours'))
         )
-        figure = go.Figure(data=data, layout=layout)
-        self.gitlab_chart = opy.plot(
-            figure, auto_open=False, output_type='div', include_plotlyjs=False
+        self.tracker_hours = {(profile_id, day): hours for profile_id, day, hours in qs}
+
+    def calc_gitlab_stats(self):
+        qs = (
+            GitCommit.objects.filter(
+                Q.created_at.date >= self.from_date,
+                Q.created_at.date <= self.to_date,
+                Q.author_profile.in_list(self.members) | Q.committer_profile.in_list(self.members),
+            )
+            .annotate(day=TruncDate('created_at'))
+            .order_by()
+            .values_list('author_profile', 'committer_profile', 'day')
+            .annotate(Sum('additions'), Sum('deletions'))
         )
+        # a commit counts both for its author and its committer, like in Report
+        for author_id, committer_id, day, adds, dels in qs:
+            for profile_id in {author_id, committer_id} - {None}:
+                changes = self.gitlab_changes.setdefault((profile_id, day), [0, 0])
+                changes[0] += adds or 0
+                changes[1] -= dels or 0
+
+    def get_member_stats(self, profile_id, date):
+        adds, dels = self.gitlab_changes.get((profile_id, date), (0, 0))
+        return {
+            'tracker_hours': self.tracker_hours.get((profile_id, date), 0),
+            'gitlab_adds': adds,
+            'gitlab_dels': dels,
+        }
+
+    def calc_summary(self):
+        for date in self.dates_list:
+            self.summary.append(
+                {
+                    'date': date,
+                    'is_weekend': date.weekday() == 5 or date.weekday() == 6,
+                    'members': [self.get_member_stats(m.id, date) for m in self.members],
+                }
+            )
+
+        for i, member in enumerate(self.members):
+            days = [d['members'][i] for d in self.summary]
+            self.totals.append(
+                {
+                    'tracker_hours': sum(d['tracker_hours'] for d in days),
+                    'gitlab_adds': sum(d['gitlab_adds'] for d in days),
+                    'gitlab_dels': sum(d['gitlab_dels'] for d in days),
+                }
+            )
+
+    def get_chart_data(self):
+        return {
+            'range': [self.from_date.isoformat(), self.to_date.isoformat()],
+            'dates': [d.isoformat() for d in self.dates_list],
+            'tracker': {
+                'members': [
+                    {
+                        'name': member.name,
+                        'hours': [d['members'][i]['tracker_hours'] for d in self.summary],
+                    }
+                    for i, member in enumerate(self.members)
+                ]
+            },
+        }
 
 
 def get_user_profiles(request):
@@ -189,6 +279,13 @@ def get_user_profiles(request):
         return Team.objects.filter(default=True).first().user_profiles.all().order_by('name')
 
 
+def get_teams(request):
+    if request.user.is_superuser:
+        return Team.objects.order_by('name')
+    else:
+        return Team.objects.filter(default=True)
+
+
 class DateRangeForm(forms.Form):
     from_date = forms.DateField(
         widget=forms.DateInput(attrs={"class": "form-control", "type": "date"})
@@ -200,6 +297,45 @@ class DateRangeForm(forms.Form):
         queryset=UserProfile.objects.all().order_by('name'),
         widget=forms.Select(attrs={"class": "form-control"}),
     )
+    # the whole team is shown instead of the user when it's selected
+    team = forms.ModelChoiceField(
+        queryset=Team.objects.all().order_by('name'),
+        required=False,
+        empty_label='No team',
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+
+
+def get_dashboard_form(request):
+    data = {
+        'from_date': request.GET.get('from_date', date.today() - timedelta(14)),
+        'to_date': request.GET.get('to_date', date.today()),
+        'user': request.GET.get('user', get_user_profiles(request).first().id),
+        'team': request.GET.get('team'),
+    }
+
+    form = DateRangeForm(data)
+    form.fields['user'].queryset = get_user_profiles(request)
+    form.fields['team'].queryset = get_teams(request)
+    return form
+
+
+def get_dashboard_report(form):
+    """
+    Report or TeamReport of a valid dashboard form, shared by the page and chart data
+    """
+    from_date = form.cleaned_data['from_date']
+    to_date = form.cleaned_data['to_date']
+    team = form.cleaned_data['team']
+    if team:
+        return get_cached_report(
+            ('team', team.id, from_date, to_date), lambda: TeamReport(team, from_date, to_date)
+        )
+
+    user = form.cleaned_data['user']
+    return get_cached_report(
+        ('user', user.id, from_date, to_date), lambda: Report(user, from_date, to_date)
+    )
 
 
 @method_decorator(login_required, name='dispatch')
@@ -207,32 +343,32 @@ class DashboardView(View):
     template_name = 'dashboard.html'
 
     def get(self, request):
-        data = {
-            'from_date': request.GET.get('from_date', date.today() - timedelta(14)),
-            'to_date': request.GET.get('to_date', date.today()),
-            'user': request.GET.get('user', get_user_profiles(request).first().id),
-        }
-
-        form = DateRangeForm(data)
-        form.fields['user'].queryset = get_user_profiles(request)
-
+        form = get_dashboard_form(request)
         c = {'form': form}
 
         if form.is_valid():
-            c['reports'] = self.get_reports(
-                form.cleaned_data['from_date'],
-                form.cleaned_data['to_date'],
-                form.cleaned_data['user'],
+            report = get_dashboard_report(form)
+            if form.cleaned_data['team']:
+                c['team_report'] = report
+            else:
+                c['reports'] = [report]
+            c['chart_url'] = '{}?{}'.format(
+                reverse('dashboard-chart-data'), request.GET.urlencode()
             )
         return render(request, self.template_name, c)
 
-    def get_reports(self, from_date, to_date, user):
-        reports = []
 
-        for u in UserProfile.objects.filter(id=user.id).order_by('name'):
-            reports.append(Report(u, from_date, to_date))
+@method_decorator(login_required, name='dispatch')
+class ChartDataView(View):
+    """
+    Chart series of the dashboard, loaded by the page lazily
+    """
 
-        return reports
+    def get(self, request):
+        form = get_dashboard_form(request)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return JsonResponse(get_dashboard_report(form).get_chart_data())
 
 
 USE_TAGS = set(
@@ -271,28 +407,35 @@ class TagsTimeView(View):
             now = datetime.now()
             from_date = now - relativedelta(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-        logs = Worklog.objects.between(
-            from_date, from_date + relativedelta(months=1, days=-1)
-        ).prefetch_related('issue', 'user_profile__team_set')
-        teams = [x.name for x in Team.objects.all()] + ['No Team']
+        # tags of issue -> user profile id -> hours
+        issue_hours = (
+            WorklogDay.objects.between(from_date, from_date + relativedelta(months=1, days=-1))
+            .filter(Q.issue != None)
+            .order_by()
+            .values_list('issue__tags', 'user_profile')
+            .annotate(Sum('hours'))
+        )
+
+        # the first team of a user profile
+        profile_teams = {}
+        teams = []
+        for team in Team.objects.order_by('pk').prefetch_related('user_profiles'):
+            teams.append(team.name)
+            for profile in team.user_profiles.all():
+                profile_teams.setdefault(profile.id, team.name)
+        teams.append('No Team')
+
         next_month = (from_date + relativedelta(months=2)).strftime('%Y-%m')
         c = {'teams': teams, 'month': from_date.strftime('%Y-%m'), 'next_month': next_month}
 
         tags = defaultdict(lambda: {x: 0 for x in teams})
-        for log in logs:
-            if not log.issue:
-                continue
-
-            has_tags = set(log.issue.tags) & use_tags
+        for issue_tags, profile_id, hours in issue_hours:
+            has_tags = set(issue_tags) & use_tags
             if not has_tags:
                 continue
             tag = has_tags.pop()
-            team = log.user_profile.team_set.first()
-            if team:
-                team = team.name
-            else:
-                team = 'No Team'
-            tags[tag][team] += log.hours
+            team = profile_teams.get(profile_id, 'No Team')
+            tags[tag][team] += hours
 
         c['tags'] = {}
         for tag, data in tags.items():
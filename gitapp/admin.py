@@ -1,10 +1,13 @@
 from django.contrib import admin
 
-from gitapp.models import GitCommit, GitProject
+from botapp import report_cache
+from botapp.report_cache import DataVersionAdminMixin
+from gitapp.models import GitBranchHead, GitCommit, GitProject
 
 
 @admin.register(GitCommit)
-class GitCommitAdmin(admin.ModelAdmin):
+class GitCommitAdmin(DataVersionAdminMixin, admin.ModelAdmin):
+    data_source = report_cache.COMMITS
     list_display = ['short_id', 'branch', 'created_at', 'title', 'additions', 'deletions',
                     'author_profile', 'committer_profile']
     list_filter = ['project', 'author_profile', 'author_email', 'committer_email']
@@ -14,3 +17,9 @@ class GitCommitAdmin(admin.ModelAdmin):
 @admin.register(GitProject)
 class GitProjectAdmin(admin.ModelAdmin):
     list_display = ['project_id', 'name', 'hosting']
+
+
+@admin.register(GitBranchHead)
+class GitBranchHeadAdmin(admin.ModelAdmin):
+    list_display = ['project', 'name', 'head_sha', 'updated']
+    list_filter = ['project']
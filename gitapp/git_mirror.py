@@ -0,0 +1,122 @@
+import logging
+import os
+import subprocess
+
+from django.conf import settings
+
+
+# separators of git log records and fields, they can't appear in commit data
+RECORD_SEP = '\x1e'
+FIELD_SEP = '\x1f'
+LOG_FIELDS = ['id', 'author_name', 'author_email', 'authored_date',
+              'committer_name', 'committer_email', 'committed_date', 'message']
+LOG_FORMAT = RECORD_SEP + FIELD_SEP.join(['%H', '%an', '%ae', '%aI', '%cn', '%ce', '%cI', '%B']) \
+    + FIELD_SEP
+
+
+class GitMirror:
+    """
+    Local bare mirror of a project repository. Commits are listed in the GitLab API
+    format, so they are imported by GitlabLoader the same way.
+    """
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+
+    @classmethod
+    def for_project(cls, project):
+        path = os.path.join(settings.GIT_MIRROR_ROOT, 'project-{}.git'.format(project.pk))
+        return cls(project.mirror_url, path)
+
+    def git(self, *args, input=None):
+        r = subprocess.run(['git', '--git-dir', self.path] + list(args), input=input,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           encoding='utf-8', errors='replace')
+        if r.returncode != 0:
+            raise Exception('git {} failed: {}'.format(args[0], r.stderr.strip()))
+        return r.stdout
+
+    def update(self):
+        if os.path.exists(self.path):
+            logging.info('Fetching mirror %s', self.path)
+            self.git('remote', 'update', '--prune')
+        else:
+            logging.info('Cloning mirror %s', self.path)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            r = subprocess.run(['git', 'clone', '--mirror', '--', self.url, self.path],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
+            if r.returncode != 0:
+                raise Exception('git clone failed: {}'.format(r.stderr.strip()))
+
+    def list_branches(self):
+        """
+        :return: dict branch name -> head sha
+        """
+        out = self.git('for-each-ref', '--format=%(refname:short) %(objectname)', 'refs/heads')
+        return dict(line.rsplit(' ', 1) for line in out.splitlines())
+
+    def list_recent_commits(self, from_date, to_date, heads=None):
+        """
+        Same as GitLabClient.list_recent_commits. Commits of moved branches are resolved
+        with `git rev-list`, their data and stats are read by a single `git log` pass.
+        """
+        heads = {} if heads is None else heads
+        self.update()
+        since = '--since={}'.format(from_date.strftime('%Y-%m-%d'))
+
+        branch_commits = []
+        current_heads = self.list_branches()
+        for branch_name, head_sha in current_heads.items():
+            old_head = heads.get(branch_name)
+            if old_head == head_sha:
+                continue
+            rev_range = [head_sha]
+            # old head could be lost after a force push
+            if old_head and self.has_commit(old_head):
+                rev_range.append('^' + old_head)
+            shas = self.git('rev-list', since, *rev_range).split()
+            branch_commits.extend((branch_name, sha) for sha in shas)
+
+        commits = self.log(list(dict.fromkeys(sha for br, sha in branch_commits)))
+        for branch_name, sha in branch_commits:
+            yield branch_name, commits[sha]
+        heads.update(current_heads)
+
+    def has_commit(self, sha):
+        r = subprocess.run(['git', '--git-dir', self.path, 'cat-file', '-e', sha + '^{commit}'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return r.returncode == 0
+
+    def log(self, shas):
+        """
+        :return: dict sha -> commit in the GitLab API format with stats
+        """
+        if not shas:
+            return {}
+        # merge commits are compared to the first parent like GitLab does
+        out = self.git('log', '--no-walk=unsorted', '--stdin', '-m', '--first-parent',
+                       '--numstat', '--format=' + LOG_FORMAT, input='\n'.join(shas) + '\n')
+        commits = {}
+        for record in out.split(RECORD_SEP)[1:]:
+            commit = self.parse_record(record)
+            commits[commit['id']] = commit
+        return commits
+
+    def parse_record(self, record):
+        values = record.split(FIELD_SEP)
+        commit = dict(zip(LOG_FIELDS, values))
+        commit['short_id'] = commit['id'][:8]
+        commit['title'] = commit['message'].split('\n', 1)[0]
+        commit['created_at'] = commit['committed_date']
+
+        additions = deletions = 0
+        for line in values[len(LOG_FIELDS)].splitlines():
+            parts = line.split('\t', 2)
+            # binary files are listed with '-' instead of numbers
+            if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+                additions += int(parts[0])
+                deletions += int(parts[1])
+        commit['stats'] = {'additions': additions, 'deletions': deletions,
+                           'total': additions + deletions}
+        return commit
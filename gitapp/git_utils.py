@@ -1,18 +1,129 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pprint import pprint
 
 import os
 
-import requests
 from dateutil.parser import parse as parse_date
 from datetime import datetime
 
+from django.conf import settings
+from django.db import connection
 from django.utils import timezone
 
+from botapp import report_cache
 from botapp.enums import GitHosting, ServiceType
-from botapp.models import ServiceAccount
-from botapp.trackers import IssueLoader
-from gitapp.models import GitProject, GitCommit
+from botapp.trackers import IssueLoader, ServiceAccountMap
+from gitapp.git_mirror import GitMirror
+from gitapp.models import GitBranchHead, GitProject, GitCommit
+from teambot import transport
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads requesting the same host. GitLab RateLimit-*
+    and Retry-After response headers pause the bucket until the limit is reset.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, response, *args, **kwargs):
+        """
+        Can be used as a requests response hook, it's called for every retry
+        """
+        headers = response.headers
+        delay = 0
+        if headers.get('Retry-After', '').isdigit():
+            delay = int(headers['Retry-After'])
+        elif headers.get('RateLimit-Remaining') == '0' and \
+                headers.get('RateLimit-Reset', '').isdigit():
+            delay = int(headers['RateLimit-Reset']) - time.time()
+        elif response.status_code == 429:
+            delay = 1
+
+        if delay > 0:
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host):
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(settings.GITLAB_RATE_LIMIT)
+        return _rate_limiters[host]
+
+
+@dataclass
+class ProjectSyncResult:
+    project: GitProject
+    commits: int = 0
+    seconds: float = 0
+    error: str = ''
+
+    def __str__(self):
+        if self.error:
+            return '{}: FAILED in {:.1f}s: {}'.format(self.project.name, self.seconds, self.error)
+        return '{}: {} commits imported in {:.1f}s'.format(self.project.name, self.commits,
+                                                          self.seconds)
+
+
+@dataclass
+class ScheduleStatus:
+    project: GitProject
+    schedule: dict
+    project_url: str = ''
+
+    @property
+    def pipeline(self):
+        return self.schedule.get('last_pipeline') or {}
+
+    @property
+    def pipeline_url(self):
+        """
+        Empty when the project url is unknown
+        """
+        if not self.project_url:
+            return ''
+        return '{}/pipelines/{}'.format(self.project_url, self.pipeline.get('id'))
 
 
 class GitLabClient:
@@ -20,6 +131,8 @@ class GitLabClient:
     Alternative client, which will support pipeline schedules
     """
     DATE_PATTERN = "%Y-%m-%d"
+    # max page size allowed by GitLab
+    PER_PAGE = 100
 
     def __init__(self):
         self.host = os.environ.get('GITLAB_HOST', '')
@@ -32,25 +145,46 @@ class GitLabClient:
             logging.warning('GITLAB_TOKEN env variable is not set!')
 
         self.api_version = '4'
+        self.rate_limiter = get_rate_limiter(self.host)
 
     def list_pipeline_schedules(self, project_id):
         path = 'projects/{}/pipeline_schedules'.format(project_id)
-        return self.fetch_path(path)
+        return list(self.iter_path(path))
 
     def get_pipeline_schedule(self, project_id, schedule_id):
         path = 'projects/{}/pipeline_schedules/{}'.format(project_id, schedule_id)
         return self.fetch_path(path)
 
-    def list_recent_commits(self, project_id, from_date, to_date):
+    def get_project(self, project_id):
+        return self.fetch_path('projects/{}'.format(project_id))
+
+    def list_recent_commits(self, project_id, from_date, to_date, heads=None):
+        """
+        :param heads: dict branch name -> head sha of the previous import. Branches with
+            the same head are skipped, moved ones are listed from the old head only.
+            Heads of listed branches are updated in place.
+        """
+        heads = {} if heads is None else heads
         since = from_date.strftime(self.DATE_PATTERN)
-        for branch in self.fetch_path('/projects/{}/repository/branches'.format(project_id),
-                                      {'per_page': 1000}):
+        for branch in self.iter_path('/projects/{}/repository/branches'.format(project_id)):
             branch_name = branch['name']
+            head_sha = branch['commit']['id']
+            if heads.get(branch_name) == head_sha:
+                continue
+
             if parse_date(branch['commit']['committed_date']).date() >= from_date:
-                branch_name = branch['name']
-                for commit in self.fetch_path('/projects/{}/repository/commits'.format(project_id),
-                                              {'since': since, 'ref_name': branch_name}):
+                ref_name = branch_name
+                if branch_name in heads:
+                    ref_name = '{}..{}'.format(heads[branch_name], branch_name)
+
+                params = {'since': since, 'ref_name': ref_name, 'with_stats': 'true'}
+                for commit in self.iter_path('/projects/{}/repository/commits'.format(project_id),
+                                             params):
+                    # commits are listed newest first
+                    if parse_date(commit['committed_date']).date() < from_date:
+                        break
                     yield branch_name, commit
+                heads[branch_name] = head_sha
 
     def get_commit_stats(self, project_id, commit_id):
         try:
@@ -60,74 +194,398 @@ class GitLabClient:
             print('Failed to fetch commit {} for project {}'.format(commit_id, project_id))
             raise e
 
+    def get_url(self, path):
+        return '{}/api/v{}/{}'.format(self.host, self.api_version, path.lstrip('/'))
+
+    def get(self, url, params):
+        self.rate_limiter.acquire()
+        return transport.get(url, params=params, headers={'Private-Token': self.token},
+                             hooks={'response': self.rate_limiter.update})
+
     def fetch_path(self, path, params={}):
-        url = '{}/api/v{}/{}'.format(self.host, self.api_version, path.lstrip('/'))
-        r = requests.get(url, params=params, headers={'Private-Token': self.token})
+        r = self.get(self.get_url(path), params)
         if r.status_code == 200:
             return r.json()
         else:
             raise Exception(r.content)
 
+    def iter_path(self, path, params=None):
+        """
+        Stream items of a paginated list page by page. Keyset pagination is followed
+        by the Link header, offset pagination by X-Next-Page.
+        """
+        url = self.get_url(path)
+        params = dict(params or {})
+        params.setdefault('per_page', self.PER_PAGE)
+        while url:
+            r = self.get(url, params)
+            if r.status_code != 200:
+                raise Exception(r.content)
+
+            yield from r.json()
+
+            if 'next' in r.links:
+                # next link contains all query parameters
+                url, params = r.links['next']['url'], {}
+            elif r.headers.get('X-Next-Page'):
+                params['page'] = r.headers['X-Next-Page']
+            else:
+                url = None
+
+
+GITHUB_BRANCHES_QUERY = '''
+query($owner: String!, $name: String!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    refs(refPrefix: "refs/heads/", first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name target { oid ... on Commit { committedDate } } }
+    }
+  }
+}
+'''
+
+GITHUB_HISTORY_FIELD = '''
+    b{i}: ref(qualifiedName: $b{i}) {{
+      target {{
+        ... on Commit {{
+          history(first: $first, since: $since, after: $c{i}) {{
+            pageInfo {{ hasNextPage endCursor }}
+            nodes {{
+              oid abbreviatedOid messageHeadline message additions deletions
+              authoredDate committedDate
+              author {{ name email }}
+              committer {{ name email }}
+            }}
+          }}
+        }}
+      }}
+    }}'''
+
+
+class GitHubClient:
+    """
+    GraphQL client, history of several branches is fetched by a single query
+    """
+    # max page size allowed by GitHub
+    PER_PAGE = 100
+    # branches requested by a single history query
+    BRANCH_BATCH = 10
+
+    def __init__(self):
+        self.host = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+        self.token = os.environ.get('GITHUB_TOKEN', '')
+
+        if not self.token:
+            logging.warning('GITHUB_TOKEN env variable is not set!')
+
+    def query(self, query, variables):
+        r = transport.post('{}/graphql'.format(self.host),
+                           json={'query': query, 'variables': variables},
+                           headers={'Authorization': 'bearer {}'.format(self.token)})
+        if r.status_code != 200:
+            raise Exception(r.content)
+        data = r.json()
+        if data.get('errors'):
+            raise Exception(data['errors'])
+        return data['data']
+
+    def iter_branches(self, owner, name):
+        variables = {'owner': owner, 'name': name, 'first': self.PER_PAGE, 'after': None}
+        while True:
+            refs = self.query(GITHUB_BRANCHES_QUERY, variables)['repository']['refs']
+            yield from refs['nodes']
+            if not refs['pageInfo']['hasNextPage']:
+                break
+            variables['after'] = refs['pageInfo']['endCursor']
+
+    def get_history_query(self, count):
+        params = ''.join(', $b{i}: String!, $c{i}: String'.format(i=i) for i in range(count))
+        fields = ''.join(GITHUB_HISTORY_FIELD.format(i=i) for i in range(count))
+        return ('query($owner: String!, $name: String!, $first: Int!, $since: GitTimestamp'
+                + params + ') {\n  repository(owner: $owner, name: $name) {'
+                + fields + '\n  }\n}\n')
+
+    def list_recent_commits(self, project_id, from_date, to_date, heads=None):
+        """
+        Same as GitLabClient.list_recent_commits, project_id is "owner/name". History of
+        a moved branch is listed until its previous head.
+        """
+        heads = {} if heads is None else heads
+        owner, name = project_id.split('/', 1)
+
+        new_heads = {}
+        for branch in self.iter_branches(owner, name):
+            head_sha = branch['target']['oid']
+            if heads.get(branch['name']) != head_sha and \
+                    parse_date(branch['target']['committedDate']).date() >= from_date:
+                new_heads[branch['name']] = head_sha
+
+        # branch name -> cursor of the next history page
+        pending = dict.fromkeys(new_heads)
+        variables = {'owner': owner, 'name': name, 'first': self.PER_PAGE,
+                     'since': from_date.strftime('%Y-%m-%dT00:00:00Z')}
+        while pending:
+            batch = list(pending.items())[:self.BRANCH_BATCH]
+            batch_vars = dict(variables)
+            for i, (branch_name, cursor) in enumerate(batch):
+                batch_vars['b{}'.format(i)] = 'refs/heads/{}'.format(branch_name)
+                batch_vars['c{}'.format(i)] = cursor
+            repository = self.query(self.get_history_query(len(batch)), batch_vars)['repository']
+
+            for i, (branch_name, cursor) in enumerate(batch):
+                ref = repository['b{}'.format(i)]
+                # branch could be deleted meanwhile
+                history = ref['target']['history'] if ref else {
+                    'nodes': [], 'pageInfo': {'hasNextPage': False}}
+
+                done = not history['pageInfo']['hasNextPage']
+                for node in history['nodes']:
+                    if node['oid'] == heads.get(branch_name):
+                        done = True
+                        break
+                    yield branch_name, self.parse_commit(node)
+
+                if done:
+                    del pending[branch_name]
+                    heads[branch_name] = new_heads[branch_name]
+                else:
+                    pending[branch_name] = history['pageInfo']['endCursor']
+
+    def parse_commit(self, node):
+        """
+        Convert a GraphQL commit into the GitLab API format
+        """
+        return {
+            'id': node['oid'],
+            'short_id': node['abbreviatedOid'],
+            'title': node['messageHeadline'],
+            'message': node['message'],
+            'author_name': node['author']['name'],
+            'author_email': node['author']['email'],
+            'authored_date': node['authoredDate'],
+            'committer_name': node['committer']['name'],
+            'committer_email': node['committer']['email'],
+            'committed_date': node['committedDate'],
+            'created_at': node['committedDate'],
+            'stats': {'additions': node['additions'],
+                      'deletions': node['deletions'],
+                      'total': node['additions'] + node['deletions']},
+        }
+
 
 class GitlabLoader:
+    hosting = GitHosting.gitlab
+    service_type = ServiceType.gitlab
+
     def __init__(self):
         # custom client
-        self.client = GitLabClient()
+        self.client = self.create_client()
         self.issue_loader = IssueLoader()
+        self.accounts = ServiceAccountMap(self.service_type)
+
+    def create_client(self):
+        return GitLabClient()
 
     def sync(self, from_date, to_date):
-        for project in GitProject.objects.filter(hosting=GitHosting.gitlab):
-            for br, commit in self.client.list_recent_commits(project.project_id,
-                                                              from_date, to_date):
-                c = GitCommit.objects.filter(hash=commit['id']).first()
-                if c:
-                    print('{} already imported "{}"'.format(c.short_id, c.title))
+        projects = list(GitProject.objects.filter(hosting=self.hosting))
+        workers = min(settings.GITLAB_CONCURRENCY, len(projects))
 
-                else:
-                    print('{} importing "{}"'.format(commit['short_id'], commit['title']))
-                    issue = self.issue_loader.get_issue(commit['title'])
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    lambda p: self.sync_project_in_thread(p, from_date, to_date), projects))
+        else:
+            results = [self.sync_project_failsafe(p, from_date, to_date) for p in projects]
+
+        print('-- {} SYNC REPORT --'.format(self.hosting.name.upper()))
+        for result in results:
+            print(result)
+        stats = transport.get_stats().get(transport.get_host(self.client.host))
+        if stats:
+            print('{}: {}'.format(self.client.host, stats))
+
+        if any(result.commits for result in results):
+            report_cache.bump_data_version(report_cache.COMMITS)
+        return results
+
+    def sync_project_in_thread(self, project, from_date, to_date):
+        try:
+            return self.sync_project_failsafe(project, from_date, to_date)
+        finally:
+            # every thread opens its own db connection
+            connection.close()
+
+    def sync_project_failsafe(self, project, from_date, to_date):
+        result = ProjectSyncResult(project)
+        started = time.monotonic()
+        try:
+            result.commits = self.sync_project(project, from_date, to_date)
+        except Exception as e:
+            logging.exception(e)
+            result.error = str(e)
+        result.seconds = time.monotonic() - started
+        return result
+
+    def sync_project(self, project, from_date, to_date):
+        imported = 0
+        branches = {}
+        # a head covers commits since from_date of the run which recorded it, heads of
+        # later runs don't cover older commits of a backfill and are listed again in full
+        heads = dict(project.branch_heads.filter(since__lte=from_date)
+                     .values_list('name', 'head_sha'))
+        used_heads = dict(heads)
+        commits = self.list_recent_commits(project, from_date, to_date, heads)
+        commits = self.iter_unique_commits(commits, branches)
+        for page in chunked(commits, GitLabClient.PER_PAGE):
+            imported += self.sync_commits(project, page)
+        self.update_branches(branches)
+        self.update_heads(project, used_heads, heads, from_date)
+        return imported
+
+    def list_recent_commits(self, project, from_date, to_date, heads):
+        if project.mirror_url:
+            return GitMirror.for_project(project).list_recent_commits(from_date, to_date, heads)
+        return self.client.list_recent_commits(project.project_id, from_date, to_date, heads)
+
+    def update_heads(self, project, used_heads, heads, from_date):
+        """
+        Heads are stored after all commits of the project are imported, listed branches
+        are stored with the since date of this run
+        """
+        changed = {name: sha for name, sha in heads.items() if used_heads.get(name) != sha}
+        if changed:
+            project.branch_heads.filter(name__in=changed.keys()).delete()
+            GitBranchHead.objects.bulk_create([
+                GitBranchHead(project=project, name=name, head_sha=sha, since=from_date)
+                for name, sha in changed.items()
+            ])
 
-                    stats = self.get_commit_stats(project.project_id, commit['short_id'])
-                    c = GitCommit(hash=commit['id'],
-                                  created_at=parse_date(commit['created_at']),
-                                  short_id=commit['short_id'],
-                                  title=commit['title'],
+    def iter_unique_commits(self, commits, branches):
+        """
+        Merged commits are listed once per branch, yield each commit only once and
+        collect names of branches which contain it into `branches` dict
+        """
+        for br, commit in commits:
+            if commit['id'] in branches:
+                branches[commit['id']].append(br)
+            else:
+                branches[commit['id']] = [br]
+                yield br, commit
 
-                                  author_name=commit['author_name'],
-                                  author_email=commit['author_email'],
-                                  authored_date=parse_date(commit['authored_date']),
+    def update_branches(self, branches):
+        changed = []
+        qs = GitCommit.objects.filter(hash__in=branches.keys()).only('hash', 'branch', 'branches')
+        for c in qs:
+            names = list(dict.fromkeys(c.branches + branches[c.hash]))
+            if names != c.branches or not c.branch:
+                c.branch = c.branch or names[0]
+                c.branches = names
+                changed.append(c)
+        GitCommit.objects.bulk_update(changed, ['branch', 'branches'])
 
-                                  committer_name=commit['committer_name'],
-                                  committer_email=commit['committer_email'],
-                                  committed_date=parse_date(commit['committed_date']),
+    def sync_commits(self, project, commits):
+        hashes = [commit['id'] for br, commit in commits]
+        imported = set(GitCommit.objects.filter(hash__in=hashes).values_list('hash', flat=True))
+        commits = [(br, commit) for br, commit in commits if commit['id'] not in imported]
+        print('{} commits already imported'.format(len(imported)))
 
-                                  project=project,
-                                  issue=issue,
+        self.issue_loader.prefetch_failsafe(commit['title'] for br, commit in commits)
+        self.accounts.prefetch(email for br, commit in commits
+                               for email in (commit['author_email'], commit['committer_email']))
 
-                                  author_profile=self.get_user_profile(commit['author_email']),
-                                  committer_profile=self.get_user_profile(
-                                      commit['committer_email']),
+        new_commits = []
+        for br, commit in commits:
+            print('{} importing "{}"'.format(commit['short_id'], commit['title']))
+            issue = self.issue_loader.get_issue(commit['title'])
 
-                                  message=commit['message'],
+            # old GitLab hosts don't support with_stats in commits list
+            stats = commit.get('stats') or self.get_commit_stats(project.project_id,
+                                                                 commit['short_id'])
+            new_commits.append(GitCommit(hash=commit['id'],
+                                         branch=br,
+                                         branches=[br],
+                                         created_at=parse_date(commit['created_at']),
+                                         short_id=commit['short_id'],
+                                         title=commit['title'],
 
-                                  additions=stats['additions'],
-                                  deletions=stats['deletions'],
-                                  total=stats['total'])
-                    c.save()
+                                         author_name=commit['author_name'],
+                                         author_email=commit['author_email'],
+                                         authored_date=parse_date(commit['authored_date']),
+
+                                         committer_name=commit['committer_name'],
+                                         committer_email=commit['committer_email'],
+                                         committed_date=parse_date(commit['committed_date']),
+
+                                         project=project,
+                                         issue=issue,
+
+                                         author_profile=self.accounts.get(commit['author_email']),
+                                         committer_profile=self.accounts.get(
+                                             commit['committer_email']),
+
+                                         message=commit['message'],
+
+                                         additions=stats['additions'],
+                                         deletions=stats['deletions'],
+                                         total=stats['total']))
+
+        # commit could be imported by a concurrent sync meanwhile
+        GitCommit.objects.bulk_create(new_commits, ignore_conflicts=True)
+        return len(new_commits)
 
     def get_commit_stats(self, project_id, commit_id):
         return self.client.get_commit_stats(project_id, commit_id)
 
-    def get_user_profile(self, uid):
-        service_account = ServiceAccount.objects.filter(uid=uid, service_type=ServiceType.gitlab) \
-            .first()
-        if service_account:
-            return service_account.user_profile
-
     def get_pipeline_schedules(self, project_id):
         schedules = self.client.list_pipeline_schedules(project_id)
-        results = []
-        for s in schedules:
-            extended = self.client.get_pipeline_schedule(project_id, s['id'])
-            results.append(extended)
-        return results
+        with ThreadPoolExecutor(max_workers=settings.GITLAB_CONCURRENCY) as executor:
+            return list(executor.map(
+                lambda s: self.client.get_pipeline_schedule(project_id, s['id']), schedules))
+
+    def get_schedule_statuses(self, projects, default_url=''):
+        """
+        Fetch schedules of all projects concurrently, requests share the host rate limit.
+        Projects which failed to respond are skipped. Web urls of projects without
+        project_url are fetched from GitLab.
+        """
+        with ThreadPoolExecutor(max_workers=settings.GITLAB_CONCURRENCY) as executor:
+            listed = list(executor.map(self.list_pipeline_schedules_failsafe, projects))
+            pairs = [(p, s['id']) for p, schedules in zip(projects, listed) for s in schedules]
+            details = executor.map(lambda ps: self.get_pipeline_schedule_failsafe(*ps), pairs)
+
+            urls = {p.pk: p.project_url or default_url for p in projects}
+            unknown = [p for p, schedules in zip(projects, listed)
+                       if schedules and not urls[p.pk]]
+            urls.update(zip([p.pk for p in unknown],
+                            executor.map(self.get_project_url_failsafe, unknown)))
+
+            return [ScheduleStatus(p, schedule, urls[p.pk])
+                    for (p, schedule_id), schedule in zip(pairs, details) if schedule]
+
+    def list_pipeline_schedules_failsafe(self, project):
+        try:
+            return self.client.list_pipeline_schedules(project.project_id)
+        except Exception as e:
+            logging.exception(e)
+            return []
+
+    def get_pipeline_schedule_failsafe(self, project, schedule_id):
+        try:
+            return self.client.get_pipeline_schedule(project.project_id, schedule_id)
+        except Exception as e:
+            logging.exception(e)
+
+    def get_project_url_failsafe(self, project):
+        try:
+            return self.client.get_project(project.project_id)['web_url']
+        except Exception as e:
+            logging.exception(e)
+            return ''
+
+
+class GithubLoader(GitlabLoader):
+    hosting = GitHosting.github
+    service_type = ServiceType.github
+
+    def create_client(self):
+        return GitHubClient()
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.12 on 2026-10-18 18:49
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitapp', '0006_auto_20210305_2223'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitcommit',
+            name='branches',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, default=list, size=None),
+        ),
+    ]
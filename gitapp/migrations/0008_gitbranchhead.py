@@ -0,0 +1,27 @@
+# Generated by Django 3.1.12 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitapp', '0007_gitcommit_branches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitBranchHead',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('head_sha', models.CharField(max_length=40)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='branch_heads', to='gitapp.gitproject')),
+            ],
+            options={
+                'unique_together': {('project', 'name')},
+            },
+        ),
+    ]
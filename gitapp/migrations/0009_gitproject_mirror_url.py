@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitapp', '0008_gitbranchhead'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitproject',
+            name='mirror_url',
+            field=models.CharField(blank=True, help_text='Clone URL of the repository for the local mirror', max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitapp', '0009_gitproject_mirror_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitbranchhead',
+            name='since',
+            field=models.DateField(null=True),
+        ),
+    ]
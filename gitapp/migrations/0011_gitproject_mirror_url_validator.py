@@ -0,0 +1,19 @@
+# Generated by Django 3.1.12 on 2026-10-18 19:54
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitapp', '0010_gitbranchhead_since'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gitproject',
+            name='mirror_url',
+            field=models.CharField(blank=True, help_text='Clone URL of the repository for the local mirror', max_length=255, validators=[django.core.validators.RegexValidator('^-', inverse_match=True, message='Clone URL must not start with "-"')]),
+        ),
+    ]
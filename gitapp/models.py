@@ -1,4 +1,6 @@
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.core.validators import RegexValidator
 from django.db import models
 
 from botapp.enums import get_choices, GitHosting
@@ -10,11 +12,40 @@ class GitProject(models.Model):
 
     name = models.CharField(max_length=50)
     hosting = models.IntegerField(default=GitHosting.gitlab, choices=get_choices(GitHosting))
+    # commits are read from a local bare mirror of this repository instead of the API
+    mirror_url = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text='Clone URL of the repository for the local mirror',
+        # git would take such a URL for an option
+        validators=[
+            RegexValidator(r'^-', inverse_match=True, message='Clone URL must not start with "-"')
+        ],
+    )
 
     def __str__(self):
         return u'{}/{}/{}'.format(self.project_id, self.name, self.hosting)
 
 
+class GitBranchHead(models.Model):
+    """
+    Head commit of a branch at the last successful import
+    """
+
+    project = models.ForeignKey(GitProject, related_name='branch_heads', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    head_sha = models.CharField(max_length=40)
+    # from_date of the import which recorded the head, older commits are not covered
+    since = models.DateField(null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['project', 'name']
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.head_sha)
+
+
 class GitCommit(models.Model):
     project = models.ForeignKey(GitProject, null=True, blank=True, on_delete=models.CASCADE)
     issue = models.ForeignKey('botapp.Issue', null=True, blank=True, on_delete=models.SET_NULL)
@@ -57,7 +88,9 @@ class GitCommit(models.Model):
     deletions = models.IntegerField(null=True, blank=True)
     total = models.IntegerField(null=True, blank=True)
 
+    # the first branch where the commit was found and all branches which contain it
     branch = models.CharField(max_length=255, blank=True)
+    branches = ArrayField(models.CharField(max_length=255), blank=True, default=list)
 
     def __str__(self):
         return '{} "{}"'.format(self.short_id, self.title)
@@ -0,0 +1,112 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.test import override_settings, TestCase
+
+from botapp.enums import GitHosting, ServiceType
+from botapp.models import ServiceAccount, UserProfile
+from gitapp.git_utils import GitlabLoader
+from gitapp.models import GitCommit, GitProject
+
+
+class TestGitMirror(TestCase):
+    from_date = date(2021, 3, 1)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.origin = os.path.join(self.tmp, 'origin')
+        self.git('init', '-q', self.origin, cwd=self.tmp)
+        # `git init -b` needs git 2.28, the docker image has an older one
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/master')
+
+        self.settings = override_settings(GIT_MIRROR_ROOT=os.path.join(self.tmp, 'mirrors'),
+                                          GITLAB_CONCURRENCY=1)
+        self.settings.enable()
+
+        self.project = GitProject.objects.create(project_id='1', name='mirrored',
+                                                 hosting=GitHosting.gitlab,
+                                                 mirror_url=self.origin)
+        self.dev = UserProfile.objects.create(name='dev')
+        ServiceAccount.objects.create(user_profile=self.dev, uid='dev@example.com',
+                                      service_type=ServiceType.gitlab)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tmp)
+
+    def git(self, *args, cwd=None):
+        env = dict(os.environ,
+                   GIT_AUTHOR_NAME='Dev', GIT_AUTHOR_EMAIL='dev@example.com',
+                   GIT_COMMITTER_NAME='Dev', GIT_COMMITTER_EMAIL='dev@example.com',
+                   GIT_AUTHOR_DATE='2021-03-02T10:00:00+03:00',
+                   GIT_COMMITTER_DATE='2021-03-02T10:00:00+03:00')
+        return subprocess.run(['git'] + list(args), cwd=cwd or self.origin, env=env, check=True,
+                              stdout=subprocess.PIPE, encoding='utf-8').stdout.strip()
+
+    def commit(self, filename, content, message):
+        with open(os.path.join(self.origin, filename), 'w') as f:
+            f.write(content)
+        self.git('add', filename)
+        self.git('commit', '-q', '-m', message)
+        return self.git('rev-parse', 'HEAD')
+
+    def sync(self):
+        return GitlabLoader().sync(self.from_date, self.from_date)[0]
+
+    def test_commits_imported_with_stats(self):
+        self.commit('a.txt', 'one\ntwo\n', 'first\n\ndetails')
+        sha = self.commit('a.txt', 'one\nthree\nfour\n', 'second')
+
+        result = self.sync()
+        assert result.commits == 2, result
+
+        commit = GitCommit.objects.get(hash=sha)
+        assert commit.short_id == sha[:8]
+        assert commit.title == 'second'
+        assert commit.branch == 'master'
+        assert commit.author_profile == self.dev
+        assert (commit.additions, commit.deletions, commit.total) == (2, 1, 3)
+        assert GitCommit.objects.get(title='first').message.startswith('first\n\ndetails')
+
+    def test_only_new_commits_listed(self):
+        self.commit('a.txt', 'one\n', 'first')
+        self.sync()
+
+        self.git('checkout', '-q', '-b', 'feature')
+        sha = self.commit('b.txt', 'b\n', 'feature commit')
+        self.git('checkout', '-q', 'master')
+        result = self.sync()
+
+        assert result.commits == 1, result
+        assert GitCommit.objects.get(hash=sha).branches == ['feature']
+        heads = dict(self.project.branch_heads.values_list('name', 'head_sha'))
+        assert heads['feature'] == sha, heads
+
+        assert self.sync().commits == 0
+
+    def test_merged_commit_branches(self):
+        self.commit('a.txt', 'one\n', 'first')
+        self.git('checkout', '-q', '-b', 'feature')
+        sha = self.commit('b.txt', 'b\n', 'feature commit')
+        self.git('checkout', '-q', 'master')
+        self.git('merge', '-q', '--ff-only', 'feature')
+
+        self.sync()
+        assert sorted(GitCommit.objects.get(hash=sha).branches) == ['feature', 'master']
+        assert GitCommit.objects.count() == 2
+
+    def test_option_like_url_not_passed_to_git(self):
+        marker = os.path.join(self.tmp, 'marker')
+        self.project.mirror_url = '--upload-pack=touch {}'.format(marker)
+        with self.assertRaises(ValidationError):
+            self.project.full_clean()
+
+        self.project.save()
+        result = self.sync()
+        # git takes the URL for a repository, not for an option
+        assert "repository '--upload-pack" in result.error, result
+        assert not os.path.exists(marker)
@@ -0,0 +1,134 @@
+import json
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from django.test import override_settings, TestCase
+
+from botapp.enums import GitHosting, ServiceType
+from botapp.models import ServiceAccount, UserProfile
+from gitapp.git_utils import GitHubClient, GithubLoader
+from gitapp.models import GitCommit, GitProject
+from teambot import transport
+
+
+def make_commit(sha, title, additions=1, deletions=0, email='dev@example.com'):
+    return {'oid': sha, 'abbreviatedOid': sha[:7], 'messageHeadline': title,
+            'message': title + '\n\nbody', 'additions': additions, 'deletions': deletions,
+            'authoredDate': '2021-03-02T10:00:00Z', 'committedDate': '2021-03-02T10:00:00Z',
+            'author': {'name': 'Dev', 'email': email},
+            'committer': {'name': 'Dev', 'email': email}}
+
+
+class GraphQLStub(BaseHTTPRequestHandler):
+    """
+    Serves branches and history queries of GitHubClient from `server.branches`
+    (branch name -> commits, newest first), cursors are offsets
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.queries.append(body)
+        variables = body['variables']
+        first = variables['first']
+
+        if 'refs(' in body['query']:
+            names = list(self.server.branches)
+            nodes = [{'name': name, 'target': {'oid': self.server.branches[name][0]['oid'],
+                                                'committedDate': '2021-03-02T10:00:00Z'}}
+                     for name in names]
+            repository = {'refs': self.page(nodes, variables['after'], first)}
+        else:
+            repository = {}
+            i = 0
+            while 'b{}'.format(i) in variables:
+                branch = variables['b{}'.format(i)][len('refs/heads/'):]
+                history = self.page(self.server.branches[branch], variables['c{}'.format(i)],
+                                    first)
+                repository['b{}'.format(i)] = {'target': {'history': history}}
+                i += 1
+
+        response = json.dumps({'data': {'repository': repository}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def page(self, nodes, cursor, first):
+        offset = int(cursor or 0)
+        end = offset + first
+        return {'nodes': nodes[offset:end],
+                'pageInfo': {'hasNextPage': end < len(nodes), 'endCursor': str(end)}}
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(GITLAB_CONCURRENCY=1)
+class TestImportGithub(TestCase):
+    today = date(2021, 3, 2)
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), GraphQLStub)
+        self.server.queries = []
+        self.server.branches = {
+            'master': [make_commit('c3', 'third', 5, 2), make_commit('c2', 'second'),
+                       make_commit('c1', 'first')],
+            'feature': [make_commit('f1', 'feature', email='other@example.com'),
+                        make_commit('c1', 'first')],
+        }
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.env = patch.dict('os.environ', {
+            'GITHUB_API_URL': 'http://127.0.0.1:{}'.format(self.server.server_port),
+            'GITHUB_TOKEN': 'token',
+        })
+        self.env.start()
+        self.page_size = patch.object(GitHubClient, 'PER_PAGE', 2)
+        self.page_size.start()
+
+        self.project = GitProject.objects.create(project_id='acme/app', name='app',
+                                                 hosting=GitHosting.github)
+        self.dev = UserProfile.objects.create(name='dev')
+        ServiceAccount.objects.create(user_profile=self.dev, uid='dev@example.com',
+                                      service_type=ServiceType.github)
+
+    def tearDown(self):
+        self.page_size.stop()
+        self.env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        transport.reset()
+
+    def sync(self):
+        return GithubLoader().sync(self.today, self.today)[0]
+
+    def test_branches_fetched_in_batched_queries(self):
+        result = self.sync()
+
+        assert result.commits == 4, result
+        # branches, both histories, the 2nd page of master
+        assert len(self.server.queries) == 3, self.server.queries
+        assert 'b1' in self.server.queries[1]['variables']
+
+        commit = GitCommit.objects.get(hash='c3')
+        assert (commit.additions, commit.deletions, commit.total) == (5, 2, 7)
+        assert commit.author_profile == self.dev
+        assert commit.title == 'third'
+        assert sorted(GitCommit.objects.get(hash='c1').branches) == ['feature', 'master']
+
+    def test_history_listed_until_previous_head(self):
+        self.sync()
+        self.server.queries = []
+        self.server.branches['master'].insert(0, make_commit('c4', 'fourth'))
+
+        result = self.sync()
+
+        assert result.commits == 1, result
+        history_vars = self.server.queries[1]['variables']
+        assert history_vars['b0'] == 'refs/heads/master' and 'b1' not in history_vars
+        assert len(self.server.queries) == 2, self.server.queries
+        heads = dict(self.project.branch_heads.values_list('name', 'head_sha'))
+        assert heads == {'master': 'c4', 'feature': 'f1'}, heads
@@ -1,11 +1,14 @@
-from datetime import datetime
-from django.test import TestCase
-from unittest.mock import patch
+import threading
+from datetime import date, datetime
+from django.test import override_settings, TestCase, TransactionTestCase
+from requests_mock import Mocker
+from unittest.mock import Mock, patch
 
+from botapp.actions import GitlabScheduledStatusAction, SyncGitlabAction
 from botapp.enums import ServiceType, GitHosting
-from botapp.models import ServiceAccount, UserProfile
-from gitapp.git_utils import GitlabLoader
-from gitapp.models import GitProject, GitCommit
+from botapp.models import Issue, ServiceAccount, UserProfile
+from gitapp.git_utils import GitLabClient, GitlabLoader, RateLimiter
+from gitapp.models import GitBranchHead, GitProject, GitCommit
 from gitapp.tests.fixtures import list_recent_commits
 
 
@@ -74,6 +77,331 @@ class TestImportGitlab(TestCase):
         assert commit.committer_profile is None
         assert commit.author_profile is None
 
+    def test_merged_commit_imported_once(self):
+        commits = list_recent_commits()
+        commits.append(['master', commits[0][1]])
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', return_value=commits), \
+                patch('gitapp.git_utils.GitlabLoader.get_commit_stats',
+                      return_value={'additions': 7, 'deletions': 3, 'total': 10}) as stats:
+            today = datetime.today()
+            GitlabLoader().sync(today, today)
+            assert stats.call_count == 3, stats.call_count
+
+        commit = GitCommit.objects.get(hash='3da541559918a808c2402bba5012f6c60b27661c')
+        assert commit.branch == 'staging', commit.branch
+        assert commit.branches == ['staging', 'master'], commit.branches
+        assert GitCommit.objects.get(hash='b75013a2ab5822b00e7ada00389c69f4ea565f68').branches \
+            == ['staging']
+
+    def test_inline_stats(self):
+        commits = list_recent_commits()
+        for br, commit in commits:
+            commit['stats'] = {'additions': 1, 'deletions': 2, 'total': 3}
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', return_value=commits), \
+                patch('gitapp.git_utils.GitlabLoader.get_commit_stats') as stats:
+            today = datetime.today()
+            GitlabLoader().sync(today, today)
+            assert not stats.called
+
+        commit = GitCommit.objects.get(hash='3da541559918a808c2402bba5012f6c60b27661c')
+        assert (commit.additions, commit.deletions, commit.total) == (1, 2, 3)
+
+    def test_imported_commits_cost_no_row_queries(self):
+        today = datetime.today()
+        GitlabLoader().sync(today, today)
+
+        # projects, branch heads, imported hashes, accounts, branches
+        with self.assertNumQueries(5):
+            GitlabLoader().sync(today, today)
+
+    # worker threads wouldn't see data of the test transaction
+    @override_settings(GITLAB_CONCURRENCY=1)
+    def test_failed_project_does_not_abort_others(self):
+        GitProject.objects.create(project_id='2', name='broken', hosting=GitHosting.gitlab)
+
+        def list_commits(project_id, from_date, to_date, heads):
+            if project_id == '2':
+                raise Exception('404 Project Not Found')
+            return list_recent_commits()
+
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', side_effect=list_commits):
+            today = datetime.today()
+            results = {r.project.name: r for r in GitlabLoader().sync(today, today)}
+
+        assert results['broken'].error == '404 Project Not Found', results['broken']
+        assert results['my-project'].commits == 3, results['my-project']
+        assert GitCommit.objects.count() == 3
+
+    def test_branch_heads_saved(self):
+        GitBranchHead.objects.create(project=self.project, name='master', head_sha='aaa')
+        GitBranchHead.objects.create(project=self.project, name='staging', head_sha='bbb')
+
+        def list_commits(project_id, from_date, to_date, heads):
+            heads['staging'] = 'ccc'
+            return []
+
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', side_effect=list_commits):
+            today = datetime.today()
+            GitlabLoader().sync(today, today)
+
+        heads = dict(self.project.branch_heads.values_list('name', 'head_sha'))
+        assert heads == {'master': 'aaa', 'staging': 'ccc'}, heads
+
+    def test_backfill_ignores_later_heads(self):
+        GitBranchHead.objects.create(project=self.project, name='master', head_sha='aaa',
+                                     since=date(2021, 3, 1))
+        GitBranchHead.objects.create(project=self.project, name='staging', head_sha='bbb',
+                                     since=date(2021, 3, 2))
+        listed_heads = []
+
+        def list_commits(project_id, from_date, to_date, heads):
+            listed_heads.append(dict(heads))
+            return []
+
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', side_effect=list_commits):
+            GitlabLoader().sync(date(2021, 3, 1), date(2021, 3, 31))
+            GitlabLoader().sync(date(2021, 2, 1), date(2021, 3, 31))
+
+        assert listed_heads == [{'master': 'aaa'}, {}], listed_heads
+        heads = dict(self.project.branch_heads.values_list('name', 'head_sha'))
+        assert heads == {'master': 'aaa', 'staging': 'bbb'}, heads
+
     def tearDown(self):
         self.patcher.stop()
         self.patcher2.stop()
+
+
+@patch.dict('os.environ', {'GITLAB_HOST': 'http://gitlab', 'GITLAB_TOKEN': 'token'})
+class TestGitLabClient(TestCase):
+    def test_offset_pagination(self):
+        with Mocker() as m:
+            # the last registered matcher is checked first
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'b1'}, {'name': 'b2'}], headers={'X-Next-Page': '2'})
+            m.get('http://gitlab/api/v4/projects/1/repository/branches?page=2',
+                  json=[{'name': 'b3'}])
+
+            branches = GitLabClient().iter_path('/projects/1/repository/branches')
+            assert [b['name'] for b in branches] == ['b1', 'b2', 'b3']
+            assert m.call_count == 2, m.call_count
+
+    def test_keyset_pagination(self):
+        next_url = 'http://gitlab/api/v4/projects/1/repository/branches?cursor=abc'
+        with Mocker() as m:
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'b1'}], headers={'Link': '<{}>; rel="next"'.format(next_url)})
+            m.get(next_url, json=[{'name': 'b2'}])
+
+            branches = GitLabClient().iter_path('/projects/1/repository/branches')
+            assert [b['name'] for b in branches] == ['b1', 'b2']
+
+    def test_commits_stop_at_since(self):
+        def commit(sha, committed_date):
+            return {'id': sha, 'committed_date': committed_date}
+
+        with Mocker() as m:
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'master', 'commit': commit('1', '2021-03-02T10:00:00Z')}])
+            m.get('http://gitlab/api/v4/projects/1/repository/commits',
+                  json=[commit('1', '2021-03-02T10:00:00Z'), commit('2', '2021-02-27T10:00:00Z')],
+                  headers={'X-Next-Page': '2'})
+
+            commits = GitLabClient().list_recent_commits(1, date(2021, 3, 1), date(2021, 3, 2))
+            assert [c['id'] for br, c in commits] == ['1']
+            assert m.call_count == 2, m.call_count
+
+    def test_unchanged_branch_skipped(self):
+        with Mocker() as m:
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'master',
+                         'commit': {'id': 'aaa', 'committed_date': '2021-03-02T10:00:00Z'}}])
+
+            heads = {'master': 'aaa'}
+            commits = GitLabClient().list_recent_commits(1, date(2021, 3, 1), date(2021, 3, 2),
+                                                         heads)
+            assert list(commits) == []
+            assert m.call_count == 1, m.call_count
+
+    def test_moved_branch_listed_from_old_head(self):
+        with Mocker() as m:
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'master',
+                         'commit': {'id': 'bbb', 'committed_date': '2021-03-02T10:00:00Z'}}])
+            commits_url = m.get('http://gitlab/api/v4/projects/1/repository/commits',
+                                json=[{'id': 'bbb', 'committed_date': '2021-03-02T10:00:00Z'}])
+
+            heads = {'master': 'aaa'}
+            commits = GitLabClient().list_recent_commits(1, date(2021, 3, 1), date(2021, 3, 2),
+                                                         heads)
+            assert [c['id'] for br, c in commits] == ['bbb']
+            assert commits_url.last_request.qs['ref_name'] == ['aaa..master']
+            assert heads == {'master': 'bbb'}
+
+    def test_same_day_runs_reuse_heads(self):
+        GitProject.objects.create(project_id=1, name='my-project', hosting=GitHosting.gitlab)
+        committed_date = '{}T10:00:00Z'.format(date.today())
+
+        with Mocker() as m:
+            m.get('http://gitlab/api/v4/projects/1/repository/branches',
+                  json=[{'name': 'master', 'commit': {'id': 'aaa',
+                                                      'committed_date': committed_date}}])
+            commits_url = m.get('http://gitlab/api/v4/projects/1/repository/commits', json=[])
+
+            SyncGitlabAction().handle(last_days=2)
+            assert commits_url.call_count == 1, commits_url.call_count
+            assert commits_url.last_request.qs['ref_name'] == ['master']
+
+            # the hourly sync runs again on the same day
+            SyncGitlabAction().handle(last_days=2)
+            assert commits_url.call_count == 1, commits_url.call_count
+
+
+@patch.dict('os.environ', {'GITLAB_HOST': 'http://gitlab', 'GITLAB_TOKEN': 'token'})
+class TestScheduleStatus(TestCase):
+    def test_schedules_of_all_projects_fetched(self):
+        projects = [GitProject.objects.create(project_id=str(i), name='p{}'.format(i),
+                                              project_url='http://gitlab/p{}'.format(i))
+                    for i in range(1, 4)]
+        with Mocker() as m:
+            for i in (1, 2):
+                m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules'.format(i),
+                      json=[{'id': 10}, {'id': 20}])
+                for schedule_id in (10, 20):
+                    m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules/{}'
+                          .format(i, schedule_id),
+                          json={'id': schedule_id, 'last_pipeline': {'id': i * schedule_id,
+                                                                     'status': 'success'}})
+            m.get('http://gitlab/api/v4/projects/3/pipeline_schedules', status_code=404,
+                  json={'message': '404 Project Not Found'})
+
+            statuses = GitlabLoader().get_schedule_statuses(projects)
+
+        assert [(s.project.name, s.schedule['id']) for s in statuses] == [
+            ('p1', 10), ('p1', 20), ('p2', 10), ('p2', 20)]
+        assert statuses[3].pipeline_url == 'http://gitlab/p2/pipelines/40'
+        assert m.call_count == 7, m.call_count
+
+    def test_unknown_project_url_fetched(self):
+        projects = [GitProject.objects.create(project_id=str(i), name='p{}'.format(i))
+                    for i in (1, 2)]
+        with Mocker() as m:
+            for i in (1, 2):
+                m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules'.format(i),
+                      json=[{'id': 10}])
+                m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules/10'.format(i),
+                      json={'id': 10, 'last_pipeline': {'id': i, 'status': 'failed'}})
+            m.get('http://gitlab/api/v4/projects/1', json={'web_url': 'http://gitlab/acme/p1'})
+            m.get('http://gitlab/api/v4/projects/2', status_code=404)
+
+            statuses = GitlabLoader().get_schedule_statuses(projects)
+
+        assert [s.pipeline_url for s in statuses] == ['http://gitlab/acme/p1/pipelines/1', '']
+
+    def test_project_url_option_used_for_single_project(self):
+        for i in (1, 2):
+            GitProject.objects.create(project_id=str(i), name='p{}'.format(i))
+        with Mocker() as m:
+            for i in (1, 2):
+                m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules'.format(i),
+                      json=[{'id': 10}])
+                m.get('http://gitlab/api/v4/projects/{}/pipeline_schedules/10'.format(i),
+                      json={'id': 10, 'last_pipeline': {'id': i, 'status': 'failed'}})
+                m.get('http://gitlab/api/v4/projects/{}'.format(i),
+                      json={'web_url': 'http://gitlab/acme/p{}'.format(i)})
+
+            with patch.object(GitlabScheduledStatusAction, 'send_message') as send_message:
+                GitlabScheduledStatusAction().handle(project_id=['1', '2'],
+                                                     project_url='http://gitlab/default')
+                GitlabScheduledStatusAction().handle(project_id=['2'],
+                                                     project_url='http://gitlab/default')
+
+        statuses = send_message.call_args_list[0][0][0]
+        assert [s.pipeline_url for s in statuses] == ['http://gitlab/acme/p1/pipelines/1',
+                                                      'http://gitlab/acme/p2/pipelines/2']
+        statuses = send_message.call_args_list[1][0][0]
+        assert [s.pipeline_url for s in statuses] == ['http://gitlab/default/pipelines/2']
+
+    def test_schedules_listed_from_all_pages(self):
+        url = 'http://gitlab/api/v4/projects/1/pipeline_schedules'
+        with Mocker() as m:
+            m.get(url, json=[{'id': 10}], headers={'X-Next-Page': '2'})
+            m.get(url + '?page=2', json=[{'id': 20}])
+            schedules = GitLabClient().list_pipeline_schedules('1')
+
+        assert [s['id'] for s in schedules] == [10, 20]
+        assert m.call_count == 2
+
+
+class TestRateLimiter(TestCase):
+    @patch('gitapp.git_utils.time.sleep')
+    def test_retry_after_pauses_requests(self, sleep):
+        limiter = RateLimiter(rate=100)
+        limiter.acquire()
+        assert not sleep.called
+
+        limiter.update(Mock(status_code=429, headers={'Retry-After': '30'}))
+        sleep.side_effect = lambda seconds: setattr(limiter, 'paused_until', 0)
+        limiter.acquire()
+        assert 29 < sleep.call_args[0][0] <= 30, sleep.call_args
+
+    @patch('gitapp.git_utils.time.sleep')
+    def test_tokens_refill(self, sleep):
+        limiter = RateLimiter(rate=1)
+        limiter.acquire()
+        sleep.side_effect = lambda seconds: setattr(limiter, 'tokens', 1)
+        limiter.acquire()
+        assert sleep.called
+
+
+@override_settings(GITLAB_CONCURRENCY=2)
+class TestParallelSync(TransactionTestCase):
+    def test_projects_synced_in_threads(self):
+        for project_id in ['1', '2']:
+            GitProject.objects.create(project_id=project_id, name=project_id,
+                                      hosting=GitHosting.gitlab)
+
+        def list_commits(project_id, from_date, to_date, heads):
+            commits = list_recent_commits()
+            for br, commit in commits:
+                commit['id'] = project_id + commit['id'][1:]
+                commit['stats'] = {'additions': 1, 'deletions': 2, 'total': 3}
+            return commits
+
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits', side_effect=list_commits):
+            today = datetime.today()
+            results = GitlabLoader().sync(today, today)
+
+        assert [r.commits for r in results] == [3, 3], results
+        assert GitCommit.objects.count() == 6
+
+    def test_same_new_issue_in_concurrent_projects(self):
+        for project_id in ['1', '2']:
+            GitProject.objects.create(project_id=project_id, name=project_id,
+                                      hosting=GitHosting.gitlab)
+
+        def list_commits(project_id, from_date, to_date, heads):
+            br, commit = list_recent_commits()[0]
+            commit.update(id=project_id * 40, title='BACK-7 fix',
+                          stats={'additions': 1, 'deletions': 2, 'total': 3})
+            return [(br, commit)]
+
+        # prefetch fails, both threads miss the issue in get_issue before any of them creates it
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch_jira_issue(issue_id):
+            barrier.wait()
+            return {'key': issue_id, 'fields': {'summary': 'fix', 'description': '',
+                                                'labels': []}}
+
+        with patch('gitapp.git_utils.GitLabClient.list_recent_commits',
+                   side_effect=list_commits), \
+                patch('botapp.jira_util.JiraFetcher.search_jira_issues',
+                      side_effect=Exception('search failed')), \
+                patch('botapp.jira_util.JiraFetcher.fetch_jira_issue',
+                      side_effect=fetch_jira_issue):
+            today = datetime.today()
+            results = GitlabLoader().sync(today, today)
+
+        assert [r.commits for r in results] == [1, 1], results
+        issue = Issue.objects.get(issue_id='BACK-7')
+        assert set(GitCommit.objects.values_list('issue', flat=True)) == {issue.id}
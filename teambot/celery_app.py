@@ -15,11 +15,12 @@ app = Celery('teambot')
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS, related_name='celery_tasks')
 app.conf.beat_schedule = {
-    # sync JIRA worklogs
+    # sync JIRA worklogs changed since the previous run,
+    # last_days is used for the first run only
     'sync-jira-hourly': {
         'task': 'botapp.tasks.sync_jira',
         'schedule': crontab(minute=2),
-        'kwargs': {'last_days': 2},
+        'kwargs': {'last_days': 2, 'incremental': True},
     },
     # That worker will fetch screenshot monitor statistics
     'sync-screenshot-monitor-daily': {
@@ -33,6 +34,12 @@ app.conf.beat_schedule = {
         'schedule': crontab(hour='*', minute=50),
         'kwargs': {'last_days': 2},
     },
+    # That worker will hourly fetch github commits
+    'sync-github-hourly': {
+        'task': 'botapp.tasks.sync_github',
+        'schedule': crontab(hour='*', minute=55),
+        'kwargs': {'last_days': 2},
+    },
     # It will collect and send to slack a daily report for the previous day
     'daily-timesheet-report': {
         'task': 'botapp.tasks.send_report',
@@ -80,14 +87,11 @@ app.conf.beat_schedule = {
             "output": "slack",
         },
     },
-    # It will report scheduled tests status into a slack command
+    # It will report scheduled tests status of all GitLab projects into a slack command
     'gitlab-scheduled-status': {
         'task': 'botapp.tasks.send_gitlab_scheduled_status',
         'schedule': crontab(hour=7, minute=0),
         'kwargs': {
-            "project_id": '60',
-            # you need to use your own project URL here
-            "project_url": os.environ.get('GITLAB_SCHEDULED_PROJECT_URL'),
             "output": "slack",
             "slack_channel": os.environ.get('SLACK_ISSUES_REPORT_CHANNEL'),
         },
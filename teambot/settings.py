@@ -102,6 +102,9 @@ JIRA_BASE_URL = os.environ.get('JIRA_BASE_URL', 'https://example.atlassian.net')
 # project keys, example keys (BACK, WEB and IOS) are used in tests
 JIRA_PROJECT_KEYS = os.environ.get('JIRA_PROJECT_KEYS', 'BACK,WEB,IOS').split(',')
 
+# max number of parallel requests to Jira while resolving worklog issues
+JIRA_CONCURRENCY = int(os.environ.get('JIRA_CONCURRENCY', '8'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -144,6 +147,50 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.environ.get('STATIC_ROOT', '/home/docker/code/static/')
 
 
+# shared HTTP transport of tracker clients, see teambot.transport
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '60'))
+# retries of 429/5xx responses and connection errors, delays grow as backoff * 2 ** attempt
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '5'))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', '1'))
+# keep-alive connections per host, should cover GITLAB_CONCURRENCY and JIRA_CONCURRENCY
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+
+# number of GitLab projects synced in parallel
+GITLAB_CONCURRENCY = int(os.environ.get('GITLAB_CONCURRENCY', '4'))
+# max requests per second to a GitLab host, shared by all sync threads of a process
+GITLAB_RATE_LIMIT = float(os.environ.get('GITLAB_RATE_LIMIT', '10'))
+# bare mirrors of projects with GitProject.mirror_url
+GIT_MIRROR_ROOT = os.environ.get('GIT_MIRROR_ROOT', os.path.join(BASE_DIR, 'git-mirrors'))
+
+# Cache is shared between uwsgi and celery processes when TEAMBOT_CACHE_URL is set,
+# redis should be configured with a maxmemory limit and volatile-lru eviction policy
+if os.environ.get('TEAMBOT_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['TEAMBOT_CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Jira issue payloads are cached for JIRA_ISSUE_CACHE_TTL seconds,
+# unknown or inaccessible issues for JIRA_ISSUE_NEGATIVE_CACHE_TTL seconds
+JIRA_ISSUE_CACHE = 'default'
+JIRA_ISSUE_CACHE_TTL = int(os.environ.get('JIRA_ISSUE_CACHE_TTL', 6 * 60 * 60))
+JIRA_ISSUE_NEGATIVE_CACHE_TTL = int(os.environ.get('JIRA_ISSUE_NEGATIVE_CACHE_TTL', 60 * 60))
+
+# computed dashboard reports, they are invalidated by data versions bumped on sync
+REPORT_CACHE = 'default'
+REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 24 * 60 * 60))
+
+
 # CELERY SETTINGS
 BROKER_URL = os.environ.get('TEAMBOT_REDIS', 'redis://redis:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
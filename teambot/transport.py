@@ -0,0 +1,143 @@
+"""
+Shared HTTP transport of tracker clients.
+
+Requests to the same host reuse one pooled keep-alive session, so TLS handshakes
+aren't repeated for every call. Responses with RETRY_STATUSES and connection errors
+are retried with exponential backoff, Retry-After header is respected. Requests which
+aren't idempotent are retried only when the server surely didn't process them.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# rate limited requests are rejected before they are processed
+NOT_PROCESSED_STATUSES = (429,)
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+
+    def __str__(self):
+        return '{} requests, {} retries, {} errors'.format(self.requests, self.retries, self.errors)
+
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_host(url):
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.HTTP_POOL_SIZE, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # responses are decoded by requests transparently
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+
+def get_session(url):
+    host = get_host(url)
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = create_session()
+            _stats[host] = HostStats()
+        return _sessions[host]
+
+
+def count(url, field):
+    with _lock:
+        stats = _stats.setdefault(get_host(url), HostStats())
+        setattr(stats, field, getattr(stats, field) + 1)
+
+
+def get_stats():
+    """
+    :return: dict host -> HostStats of the current process
+    """
+    with _lock:
+        return {host: HostStats(**vars(stats)) for host, stats in _stats.items()}
+
+
+def reset():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _stats.clear()
+
+
+def get_retry_delay(response, attempt):
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return int(retry_after)
+    return settings.HTTP_BACKOFF_FACTOR * 2**attempt
+
+
+def is_connect_error(e):
+    """
+    Connection wasn't established, so the request wasn't sent
+    """
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def request(method, url, retries=None, idempotent=True, **kwargs):
+    """
+    Send a request through the pooled session of the url host.
+
+    :param retries: number of retries, settings.HTTP_RETRIES by default
+    :param idempotent: False for requests which must not be repeated once the server got
+        them, e.g. posting a message. They are retried only on connect errors and 429.
+    :return: the last response, connection errors are raised after the last retry
+    """
+    retries = settings.HTTP_RETRIES if retries is None else retries
+    retry_statuses = RETRY_STATUSES if idempotent else NOT_PROCESSED_STATUSES
+    kwargs.setdefault('timeout', (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+    session = get_session(url)
+
+    for attempt in range(retries + 1):
+        count(url, 'requests' if attempt == 0 else 'retries')
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            count(url, 'errors')
+            if attempt == retries or not (idempotent or is_connect_error(e)):
+                raise
+            log.warning('%s %s failed: %s, retrying', method.upper(), url, e)
+            response = None
+        else:
+            if response.status_code not in retry_statuses or attempt == retries:
+                return response
+            count(url, 'errors')
+            log.warning('%s %s: %s, retrying', method.upper(), url, response.status_code)
+        time.sleep(get_retry_delay(response, attempt))
+
+
+def get(url, **kwargs):
+    return request('get', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('post', url, **kwargs)
@@ -16,11 +16,12 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 
-from botapp.views import DashboardView, TagsTimeView
+from botapp.views import ChartDataView, DashboardView, TagsTimeView
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^agile/', include('agileapp.urls')),
     url(r'^tags_time/', TagsTimeView.as_view()),
+    url(r'^chart_data/$', ChartDataView.as_view(), name='dashboard-chart-data'),
     url(r'^$', DashboardView.as_view()),
 ]